@@ -1,27 +1,66 @@
 import asyncio
 import logging
-from typing import List, Tuple
+from typing import Any, AsyncIterator, List, Optional, Tuple
 
 import aiohttp
 
+try:  # orjson é opcional
+    from orjson import loads as json_loads
+except Exception:  # pragma: no cover - biblioteca ausente
+    from json import loads as json_loads
+
+try:  # ijson é opcional
+    import ijson
+except Exception:  # pragma: no cover - biblioteca ausente
+    ijson = None
+
 from geocoding import (
     get_city_bbox,
-    dentro_da_cidade,
     get_city_area_id,
     get_city_polygon,
-    point_in_polygon,
+    normalizar_nome,
 )
+from data_fetch import (
+    OSRM_CHUNK,
+    OVERPASS_URL,
+    candidato_poi,
+    decode_distances,
+    decode_elevations,
+    decode_polyline,
+    osrm_coords,
+    overpass_query,
+    selecionar_pois,
+)
+from reliability import CircuitOpenError, backoff_delay, breaker_for
+from singleflight import coalesce_async
 
 log = logging.getLogger(__name__)
 
+# Tentativas por bloco antes de recorrer às requisições linha a linha
+OSRM_CHUNK_ATTEMPTS = 3
+
 _session: aiohttp.ClientSession | None = None
 
+# Timeout padrão das requisições; chamadas individuais podem sobrescrevê-lo
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=5)
+
 
 def get_session() -> aiohttp.ClientSession:
-    """Retorna uma sessão ``aiohttp`` reutilizável."""
+    """Retorna uma sessão ``aiohttp`` reutilizável.
+
+    O conector mantém conexões *keep-alive* e cache de DNS para evitar novos
+    handshakes TCP/TLS a cada chamada às APIs.
+    """
     global _session
     if _session is None or _session.closed:
-        _session = aiohttp.ClientSession()
+        connector = aiohttp.TCPConnector(
+            limit=64,
+            limit_per_host=16,
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
     return _session
 
 
@@ -33,192 +72,254 @@ async def close_session() -> None:
     _session = None
 
 
-async def coletar_pois_async(cidade: str) -> List[dict]:
-    """Busca bares e restaurantes via Overpass de forma assíncrona."""
-    bbox = get_city_bbox(cidade)
-    area_id = get_city_area_id(cidade)
-    poly = get_city_polygon(cidade)
-    if area_id:
-        q = f"""
-        [out:json][timeout:60];
-        area({area_id})->.a;
-        (
-          node[\"amenity\"=\"bar\"](area.a);
-          way[\"amenity\"=\"bar\"](area.a);
-          rel[\"amenity\"=\"bar\"](area.a);
-          node[\"bar\"=\"yes\"](area.a);
-          node[\"craft\"=\"brewery\"](area.a);
-          node[\"shop\"=\"alcohol\"](area.a);
-          node[\"amenity\"=\"pub\"](area.a);
-          node[\"amenity\"=\"cafe\"](area.a);
-          node[\"amenity\"=\"fast_food\"](area.a);
-          node[\"amenity\"=\"nightclub\"](area.a);
-        );
-        out center tags;
-        """
-    elif bbox:
-        s, n, w, e = bbox
-        q = f"""
-        [out:json][timeout:60];
-        (
-          node[\"amenity\"=\"bar\"]({s},{w},{n},{e});
-          node[\"bar\"=\"yes\"]({s},{w},{n},{e});
-          node[\"craft\"=\"brewery\"]({s},{w},{n},{e});
-          node[\"shop\"=\"alcohol\"]({s},{w},{n},{e});
-          node[\"amenity\"=\"pub\"]({s},{w},{n},{e});
-          node[\"amenity\"=\"cafe\"]({s},{w},{n},{e});
-          node[\"amenity\"=\"fast_food\"]({s},{w},{n},{e});
-          node[\"amenity\"=\"nightclub\"]({s},{w},{n},{e});
-        );
-        out center tags;
-        """
+async def _iter_elements(resp: aiohttp.ClientResponse) -> AsyncIterator[dict]:
+    """Itera os ``elements`` de uma resposta Overpass.
+
+    Com ``ijson`` o corpo é decodificado em fluxo, à medida que chega, sem
+    materializar o documento inteiro na memória.
+    """
+    if ijson is not None:
+        async for el in ijson.items_async(resp.content, "elements.item", use_float=True):
+            yield el
     else:
-        q = f"""
-        [out:json][timeout:60];
-        area[\"name\"=\"{cidade}\"][boundary=\"administrative\"][admin_level=\"8\"]->.a;
-        (
-          node[\"amenity\"=\"bar\"](area.a);
-          way[\"amenity\"=\"bar\"](area.a);
-          rel[\"amenity\"=\"bar\"](area.a);
-        );
-        out center tags;
-        """
+        for el in json_loads(await resp.read()).get("elements", []):
+            yield el
+
+
+def _area_e_poligono(cidade: str) -> Tuple[Optional[int], Any]:
+    """Obtém ``area id`` e polígono da cidade (o polígono depende da área)."""
+    return get_city_area_id(cidade), get_city_polygon(cidade)
 
+
+@coalesce_async(lambda cidade: cidade)
+async def coletar_pois_async(cidade: str) -> List[dict]:
+    """Busca bares e restaurantes via Overpass de forma assíncrona."""
+    bbox, (area_id, poly) = await asyncio.gather(
+        asyncio.to_thread(get_city_bbox, cidade),
+        asyncio.to_thread(_area_e_poligono, cidade),
+    )
+    q = overpass_query(cidade, area_id, bbox)
+    cidade_norm = normalizar_nome(cidade)
+    candidatos = []
     session = get_session()
     try:
-        async with session.post(
-            "http://overpass-api.de/api/interpreter", data={"data": q}, timeout=60
-        ) as resp:
-            resp.raise_for_status()
-            elements = (await resp.json()).get("elements", [])
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        with breaker_for(OVERPASS_URL):
+            async with session.post(OVERPASS_URL, data={"data": q}) as resp:
+                resp.raise_for_status()
+                async for el in _iter_elements(resp):
+                    candidato = candidato_poi(el, cidade_norm)
+                    if candidato:
+                        candidatos.append(candidato)
+    except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
         log.error(f"Erro Overpass: {e}")
         return []
     except Exception as e:
         log.error(f"Erro ao decodificar resposta Overpass: {e}")
         return []
-
-    pois = []
-    for el in elements:
-        tags = el.get("tags", {})
-        name = tags.get("name")
-        lat = el.get("lat") or el.get("center", {}).get("lat")
-        lon = el.get("lon") or el.get("center", {}).get("lon")
-        if not (name and lat and lon):
-            continue
-        city_tag = tags.get("addr:city")
-        if city_tag and city_tag.lower() != cidade.lower():
-            continue
-        if poly and not point_in_polygon(float(lat), float(lon), poly):
-            continue
-        if bbox and not poly and not dentro_da_cidade(lat, lon, bbox):
-            continue
-        pois.append({"name": name, "lat": float(lat), "lon": float(lon)})
-    return pois
+    return selecionar_pois(candidatos, bbox, poly)
 
 
-async def batch_altitude_async(latlons: List[Tuple[float, float]]) -> List[float]:
-    """Obtém altitudes via Open-Elevation de forma assíncrona."""
+async def _post_altitudes(latlons: List[Tuple[float, float]]) -> List[float]:
+    """Consulta o Open-Elevation com um único POST para todos os ``latlons``."""
     locs = [{"latitude": lat, "longitude": lon} for lat, lon in latlons]
+    url = "https://api.open-elevation.com/api/v1/lookup"
     session = get_session()
     try:
-        async with session.post(
-            "https://api.open-elevation.com/api/v1/lookup",
-            json={"locations": locs},
-            timeout=30,
-        ) as resp:
-            resp.raise_for_status()
-            data = (await resp.json()).get("results", [])
-            return [r.get("elevation", 0) for r in data]
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        with breaker_for(url):
+            async with session.post(
+                url,
+                json={"locations": locs},
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as resp:
+                resp.raise_for_status()
+                return decode_elevations(await resp.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
         log.error(f"Erro Open-Elevation: {e}")
     except Exception as e:
         log.error(f"Erro ao processar resposta Open-Elevation: {e}")
     return [0] * len(locs)
 
 
+class _AltitudeBatcher:
+    """Agrupa consultas de altitude próximas no tempo em um único POST.
+
+    Pontos recebidos dentro de ``max_window`` segundos (ou até somar
+    ``max_size`` pontos) são enviados juntos ao Open-Elevation e o resultado
+    é repartido entre os chamadores.
+    """
+
+    def __init__(self, max_window: float = 0.05, max_size: int = 100) -> None:
+        self.max_window = max_window
+        self.max_size = max_size
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: List[Tuple[List[Tuple[float, float]], asyncio.Future]] = []
+        self._size = 0
+        self._handle: asyncio.TimerHandle | None = None
+        self._tasks: set = set()
+
+    async def submit(self, latlons: List[Tuple[float, float]]) -> List[float]:
+        """Enfileira ``latlons`` e aguarda suas altitudes."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._pending, self._size, self._handle = loop, [], 0, None
+        fut = loop.create_future()
+        self._pending.append((list(latlons), fut))
+        self._size += len(latlons)
+        if self._size >= self.max_size:
+            self._flush()
+        elif self._handle is None:
+            self._handle = loop.call_later(self.max_window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending, self._size = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[List[Tuple[float, float]], asyncio.Future]]) -> None:
+        points = [p for latlons, _ in batch for p in latlons]
+        elevs = await _post_altitudes(points)
+        if len(elevs) != len(points):
+            log.error(f"Open-Elevation retornou {len(elevs)} de {len(points)} altitudes")
+            elevs = [0] * len(points)
+        offset = 0
+        for latlons, fut in batch:
+            if not fut.done():
+                fut.set_result(elevs[offset:offset + len(latlons)])
+            offset += len(latlons)
+
+
+_altitude_batcher = _AltitudeBatcher()
+
+
+@coalesce_async(lambda latlons: tuple(map(tuple, latlons)))
+async def batch_altitude_async(latlons: List[Tuple[float, float]]) -> List[float]:
+    """Obtém altitudes via Open-Elevation de forma assíncrona.
+
+    Chamadas concorrentes são agrupadas em uma única requisição.
+    """
+    if not latlons:
+        return []
+    return await _altitude_batcher.submit(latlons)
+
+
+async def _osrm_chunk(
+    session: aiohttp.ClientSession,
+    url: str,
+    src_ids: List[int],
+    timeout: aiohttp.ClientTimeout,
+) -> List[List[float]]:
+    """Busca as linhas ``src_ids`` da matriz OSRM em uma única requisição."""
+    params = {"annotations": "distance", "sources": ";".join(map(str, src_ids))}
+    with breaker_for(url):
+        async with session.get(url, params=params, timeout=timeout) as r:
+            r.raise_for_status()
+            rows = decode_distances(await r.read())
+    if len(rows) != len(src_ids):
+        raise ValueError(f"esperadas {len(src_ids)} linhas, recebidas {len(rows)}")
+    return rows
+
+
 async def osrm_table_async(
     latlons: List[Tuple[float, float]], timeout: int = 30
 ) -> List[List[float]]:
     """Retorna matriz de distâncias usando OSRM de forma assíncrona."""
-    coord_str = ";".join(f"{lon},{lat}" for lat, lon in latlons)
-    url = f"http://router.project-osrm.org/table/v1/foot/{coord_str}"
+    url = f"http://router.project-osrm.org/table/v1/foot/{osrm_coords(latlons)}"
     params = {"annotations": "distance"}
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    breaker = breaker_for(url)
     session = get_session()
     try:
-        async with session.get(url, params=params, timeout=timeout) as resp:
-            resp.raise_for_status()
-            return (await resp.json()).get("distances", [])
+        with breaker:
+            async with session.get(url, params=params, timeout=client_timeout) as resp:
+                resp.raise_for_status()
+                return decode_distances(await resp.read())
+    except CircuitOpenError as e:
+        log.error(f"Erro OSRM Table: {e}")
+        return [[0] * len(latlons) for _ in latlons]
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        log.warning(f"OSRM Table falhou, tentando linha a linha: {e}")
+        log.warning(f"OSRM Table falhou, tentando em blocos: {e}")
 
         async def fetch_row(i: int) -> Tuple[int, List[float] | None]:
             try:
-                async with session.get(
-                    url,
-                    params={"annotations": "distance", "sources": i},
-                    timeout=timeout,
-                ) as r:
-                    r.raise_for_status()
-                    row = (await r.json()).get("distances", [[0] * len(latlons)])[0]
-                    return i, row
+                with breaker:
+                    async with session.get(
+                        url,
+                        params={"annotations": "distance", "sources": i},
+                        timeout=client_timeout,
+                    ) as r:
+                        r.raise_for_status()
+                        rows = decode_distances(await r.read())
+                return i, (rows or [[0] * len(latlons)])[0]
             except Exception as exc:
                 log.error(f"OSRM Table linha {i} falhou: {exc}")
                 return i, None
 
-        tasks = [fetch_row(i) for i in range(len(latlons))]
+        async def fetch_chunk(chunk: List[int]) -> Tuple[List[int], List[List[float] | None]]:
+            # Um bloco com todas as linhas repetiria a requisição que falhou
+            attempts = OSRM_CHUNK_ATTEMPTS if len(chunk) < len(latlons) else 0
+            for attempt in range(attempts):
+                if attempt:
+                    await asyncio.sleep(backoff_delay(attempt))
+                try:
+                    return chunk, await _osrm_chunk(session, url, chunk, client_timeout)
+                except CircuitOpenError as exc:
+                    log.warning(f"OSRM Table bloco {chunk[0]}-{chunk[-1]}: {exc}")
+                    break
+                except Exception as exc:
+                    log.warning(f"OSRM Table bloco {chunk[0]}-{chunk[-1]} falhou: {exc}")
+            rows = await asyncio.gather(*(fetch_row(i) for i in chunk))
+            return chunk, [row for _, row in rows]
+
+        ids = list(range(len(latlons)))
+        chunks = [ids[k:k + OSRM_CHUNK] for k in range(0, len(ids), OSRM_CHUNK)]
         results = [None] * len(latlons)
-        for idx, row in await asyncio.gather(*tasks):
-            if row is None:
-                return [[0] * len(latlons) for _ in latlons]
-            results[idx] = row
+        for chunk, rows in await asyncio.gather(*(fetch_chunk(c) for c in chunks)):
+            for idx, row in zip(chunk, rows):
+                if row is None:
+                    return [[0] * len(latlons) for _ in latlons]
+                results[idx] = row
         return results
     except Exception as e:
         log.error(f"Erro ao processar resposta OSRM: {e}")
         return [[0] * len(latlons) for _ in latlons]
 
 
-async def fetch_route_geometry_async(
-    a: Tuple[float, float], b: Tuple[float, float]
-) -> List[Tuple[float, float]]:
-    """Busca linha de caminho entre dois pontos via OSRM de forma assíncrona."""
-    url = f"http://router.project-osrm.org/route/v1/foot/{a[1]},{a[0]};{b[1]},{b[0]}"
-    session = get_session()
-    try:
-        async with session.get(
-            url, params={"overview": "full", "geometries": "geojson"}, timeout=30
-        ) as resp:
-            resp.raise_for_status()
-            coords = (await resp.json())["routes"][0]["geometry"]["coordinates"]
-            return [(lat, lng) for lng, lat in coords]
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        log.error(f"Erro OSRM Route: {e}")
-    except Exception as e:
-        log.error(f"Erro ao processar resposta OSRM Route: {e}")
-    return []
-
-
 async def fetch_route_geometry_multi_async(
     points: List[Tuple[float, float]]
 ) -> List[Tuple[float, float]]:
     """Obtém a geometria de uma rota que passa por ``points`` de forma assíncrona."""
-    coord_str = ";".join(f"{lon},{lat}" for lat, lon in points)
-    url = f"http://router.project-osrm.org/route/v1/foot/{coord_str}"
+    url = f"http://router.project-osrm.org/route/v1/foot/{osrm_coords(points)}"
     session = get_session()
     try:
-        async with session.get(
-            url, params={"overview": "full", "geometries": "geojson"}, timeout=30
-        ) as resp:
-            resp.raise_for_status()
-            coords = (await resp.json())["routes"][0]["geometry"]["coordinates"]
-            return [(lat, lng) for lng, lat in coords]
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        with breaker_for(url):
+            async with session.get(
+                url,
+                params={"overview": "full", "geometries": "polyline6"},
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as resp:
+                resp.raise_for_status()
+                data = json_loads(await resp.read())
+        return decode_polyline(data["routes"][0]["geometry"])
+    except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
         log.error(f"Erro OSRM Route múltiplo: {e}")
     except Exception as e:
         log.error(f"Erro ao processar resposta OSRM Route múltiplo: {e}")
     return []
 
 
+async def fetch_route_geometry_async(
+    a: Tuple[float, float], b: Tuple[float, float]
+) -> List[Tuple[float, float]]:
+    """Busca linha de caminho entre dois pontos via OSRM de forma assíncrona."""
+    return await fetch_route_geometry_multi_async([a, b])
+
+
 __all__ = [
     "coletar_pois_async",
     "batch_altitude_async",
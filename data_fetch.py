@@ -1,36 +1,49 @@
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Tuple
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
 
+import numpy as np
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+try:  # orjson é opcional
+    from orjson import loads as json_loads
+except Exception:  # pragma: no cover - biblioteca ausente
+    from json import loads as json_loads
+
+try:  # polyline é opcional
+    import polyline
+except Exception:  # pragma: no cover - biblioteca ausente
+    polyline = None
+
+try:  # msgspec é opcional
+    import msgspec
+except Exception:  # pragma: no cover - biblioteca ausente
+    msgspec = None
 
 from geocoding import (
+    OVERPASS_URL,
+    POOL_SIZE,
+    session,
     get_city_bbox,
-    dentro_da_cidade,
     get_city_area_id,
     get_city_polygon,
-    point_in_polygon,
+    mascara_cidade,
+    normalizar_nome,
 )
+from reliability import CircuitOpenError, breaker_for
+from singleflight import coalesce
 
 log = logging.getLogger(__name__)
 
-# Sessao HTTP com retries
-session = requests.Session()
-retries = Retry(total=5, backoff_factor=1, status_forcelist=[502,504,522,524], allowed_methods=["GET","POST"])
-adapter = HTTPAdapter(max_retries=retries)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+# Linhas da matriz OSRM solicitadas por requisição no fallback em blocos
+OSRM_CHUNK = 16
 
 
-def coletar_pois(cidade: str) -> List[dict]:
-    """Busca bares e restaurantes via Overpass."""
-    bbox = get_city_bbox(cidade)
-    area_id = get_city_area_id(cidade)
-    poly = get_city_polygon(cidade)
+def overpass_query(cidade: str, area_id: Optional[int], bbox: Optional[Tuple[float, float, float, float]]) -> str:
+    """Monta a consulta Overpass de bares, pela área, bbox ou nome da cidade."""
     if area_id:
-        q = f"""
+        return f"""
         [out:json][timeout:60];
         area({area_id})->.a;
         (
@@ -47,9 +60,9 @@ def coletar_pois(cidade: str) -> List[dict]:
         );
         out center tags;
         """
-    elif bbox:
+    if bbox:
         s, n, w, e = bbox
-        q = f"""
+        return f"""
         [out:json][timeout:60];
         (
           node[\"amenity\"=\"bar\"]({s},{w},{n},{e});
@@ -63,8 +76,7 @@ def coletar_pois(cidade: str) -> List[dict]:
         );
         out center tags;
         """
-    else:
-        q = f"""
+    return f"""
         [out:json][timeout:60];
         area[\"name\"=\"{cidade}\"][boundary=\"administrative\"][admin_level=\"8\"]->.a;
         (
@@ -74,90 +86,328 @@ def coletar_pois(cidade: str) -> List[dict]:
         );
         out center tags;
         """
+
+
+def candidato_poi(el: dict, cidade_norm: str) -> Optional[Tuple[str, float, float]]:
+    """Extrai ``(nome, lat, lon)`` de um elemento Overpass, se aceitável."""
+    tags = el.get("tags", {})
+    name = tags.get("name")
+    lat = el.get("lat") or el.get("center", {}).get("lat")
+    lon = el.get("lon") or el.get("center", {}).get("lon")
+    if not (name and lat and lon):
+        return None
+    city_tag = tags.get("addr:city")
+    if city_tag and normalizar_nome(city_tag) != cidade_norm:
+        return None
+    return name, float(lat), float(lon)
+
+
+def selecionar_pois(candidatos: List[Tuple[str, float, float]], bbox, poly) -> List[dict]:
+    """Mantém os candidatos dentro da cidade, um por nome (sem caixa).
+
+    O teste geométrico é feito de uma vez sobre arrays NumPy; o primeiro
+    candidato dentro da cidade vence entre os de mesmo nome.
+    """
+    lats = np.fromiter((c[1] for c in candidatos), dtype=float, count=len(candidatos))
+    lons = np.fromiter((c[2] for c in candidatos), dtype=float, count=len(candidatos))
+    pois_by_name = {}
+    for i in np.flatnonzero(mascara_cidade(lats, lons, bbox, poly)):
+        name, lat, lon = candidatos[i]
+        pois_by_name.setdefault(name.casefold(), {"name": name, "lat": lat, "lon": lon})
+    return list(pois_by_name.values())
+
+
+@coalesce(lambda cidade: cidade)
+def coletar_pois(cidade: str) -> List[dict]:
+    """Busca bares e restaurantes via Overpass."""
+    bbox = get_city_bbox(cidade)
+    area_id = get_city_area_id(cidade)
+    poly = get_city_polygon(cidade)
+    q = overpass_query(cidade, area_id, bbox)
     try:
-        resp = session.post("http://overpass-api.de/api/interpreter", data={"data": q}, timeout=60)
-        resp.raise_for_status()
-    except requests.RequestException as e:
+        with breaker_for(OVERPASS_URL):
+            resp = session.post(OVERPASS_URL, data={"data": q}, timeout=60)
+            resp.raise_for_status()
+    except (requests.RequestException, CircuitOpenError) as e:
         log.error(f"Erro Overpass: {e}")
         return []
 
     try:
-        elements = resp.json().get("elements", [])
+        elements = json_loads(resp.content).get("elements", [])
     except Exception as e:
         log.error(f"Erro ao decodificar resposta Overpass: {e}")
         return []
 
-    pois_by_name = {}
-    for el in elements:
-        tags = el.get("tags", {})
-        name = tags.get("name")
-        lat = el.get("lat") or el.get("center", {}).get("lat")
-        lon = el.get("lon") or el.get("center", {}).get("lon")
-        if not (name and lat and lon):
-            continue
-        city_tag = tags.get("addr:city")
-        if city_tag and city_tag.lower() != cidade.lower():
-            continue
-        if poly and not point_in_polygon(float(lat), float(lon), poly):
-            continue
-        if bbox and not poly and not dentro_da_cidade(float(lat), float(lon), bbox):
-            continue
-        if name not in pois_by_name:
-            pois_by_name[name] = {
-                "name": name,
-                "lat": float(lat),
-                "lon": float(lon),
-            }
-    return list(pois_by_name.values())
+    cidade_norm = normalizar_nome(cidade)
+    candidatos = [c for c in (candidato_poi(el, cidade_norm) for el in elements) if c]
+    return selecionar_pois(candidatos, bbox, poly)
+
+
+def osrm_coords(latlons: Sequence[Tuple[float, float]]) -> str:
+    """Formata ``latlons`` como ``lon,lat;lon,lat...`` para URLs do OSRM.
+
+    Usa 6 casas decimais (~0,1 m), aceitas pelo OSRM, e memoriza as listas
+    recentes: a mesma lista de pontos é usada pela tabela e pela rota.
+    """
+    return _osrm_coords(tuple((float(lat), float(lon)) for lat, lon in latlons))
+
+
+@lru_cache(maxsize=32)
+def _osrm_coords(latlons: Tuple[Tuple[float, float], ...]) -> str:
+    return ";".join("%.6f,%.6f" % (lon, lat) for lat, lon in latlons)
+
+
+def decode_polyline(encoded: str, precision: int = 6) -> List[Tuple[float, float]]:
+    """Decodifica uma *encoded polyline* do OSRM em pares ``(lat, lon)``.
+
+    Usa o pacote ``polyline`` quando instalado; caso contrário decodifica o
+    formato do Google localmente. ``precision=6`` corresponde a
+    ``geometries=polyline6``.
+    """
+    if polyline is not None:
+        return polyline.decode(encoded, precision)
+    factor = 10 ** precision
+    coords = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append((lat / factor, lon / factor))
+    return coords
+
+
+if msgspec is not None:
+
+    class _OsrmTable(msgspec.Struct):
+        distances: List[List[Optional[float]]] = []
+
+    class _Elevation(msgspec.Struct):
+        elevation: Optional[float] = 0.0
+
+    class _ElevationResponse(msgspec.Struct):
+        results: List[_Elevation] = []
+
+    _table_decoder = msgspec.json.Decoder(_OsrmTable)
+    _elevation_decoder = msgspec.json.Decoder(_ElevationResponse)
+
+
+def decode_distances(body: bytes) -> List[List[float]]:
+    """Extrai ``distances`` do corpo de uma resposta OSRM Table.
+
+    Com ``msgspec`` a matriz é decodificada direto para listas de ``float``
+    segundo um esquema tipado, sem criar os dicionários intermediários.
+    """
+    if msgspec is not None:
+        return _table_decoder.decode(body).distances
+    return json_loads(body).get("distances", [])
+
+
+def decode_elevations(body: bytes) -> List[float]:
+    """Extrai as altitudes do corpo de uma resposta do Open-Elevation.
+
+    Altitudes ``null`` (pontos sem dado) viram ``0.0``: um NaN chegaria à
+    penalidade de subida e ao ``argmin`` da escolha do destino.
+    """
+    if msgspec is not None:
+        elevs = [r.elevation for r in _elevation_decoder.decode(body).results]
+    else:
+        elevs = [r.get("elevation") for r in json_loads(body).get("results", [])]
+    return [0.0 if e is None else e for e in elevs]
 
 
 def batch_altitude(latlons: List[Tuple[float, float]]) -> List[float]:
     """Obtém altitudes via Open-Elevation."""
     locs = [{"latitude": lat, "longitude": lon} for lat, lon in latlons]
+    url = "https://api.open-elevation.com/api/v1/lookup"
     try:
-        resp = session.post("https://api.open-elevation.com/api/v1/lookup", json={"locations": locs}, timeout=30)
-        resp.raise_for_status()
-        data = resp.json().get("results", [])
-        return [r.get("elevation", 0) for r in data]
-    except requests.RequestException as e:
+        with breaker_for(url):
+            resp = session.post(url, json={"locations": locs}, timeout=30)
+            resp.raise_for_status()
+        return decode_elevations(resp.content)
+    except (requests.RequestException, CircuitOpenError) as e:
         log.error(f"Erro Open-Elevation: {e}")
     except Exception as e:
         log.error(f"Erro ao processar resposta Open-Elevation: {e}")
     return [0] * len(locs)
 
 
-def osrm_table(latlons: List[Tuple[float, float]], timeout: int = 30) -> List[List[float]]:
-    """Retorna matriz de distâncias usando OSRM."""
-    coord_str = ";".join(f"{lon},{lat}" for lat, lon in latlons)
-    url = f"http://router.project-osrm.org/table/v1/foot/{coord_str}"
+def osrm_table(
+    latlons: Sequence[Tuple[float, float]],
+    timeout: int = 30,
+    sources: Optional[Sequence[int]] = None,
+    destinations: Optional[Sequence[int]] = None,
+    symmetric: bool = False,
+) -> List[List[float]]:
+    """Retorna matriz de distâncias usando OSRM.
+
+    ``sources`` e ``destinations`` restringem a consulta às linhas e colunas
+    indicadas (índices de ``latlons``); a matriz retornada tem então
+    ``len(sources) x len(destinations)``. Nesse modo não há fallback em
+    blocos.
+
+    Com ``symmetric=True`` (ignorado quando ``sources``/``destinations`` são
+    informados) apenas o triângulo superior é pedido ao OSRM, em blocos de
+    linhas, e espelhado para o inferior. Para o perfil a pé as distâncias
+    ``i -> j`` e ``j -> i`` praticamente coincidem; pequenas diferenças de
+    sentido (rampas, travessias) deixam de ser representadas.
+
+    Matrizes obtidas com sucesso são memorizadas pelas coordenadas
+    (arredondadas a 6 casas, a precisão enviada ao OSRM); falhas devolvem
+    zeros e não são memorizadas.
+    """
+    key = tuple((round(float(lat), 6), round(float(lon), 6)) for lat, lon in latlons)
+    src = tuple(sources) if sources is not None else None
+    dst = tuple(destinations) if destinations is not None else None
+    try:
+        if symmetric and src is None and dst is None and len(key) > 2:
+            return _osrm_table_simetrica(key, timeout)
+        return [list(row) for row in _osrm_table_cached(key, src, dst, timeout)]
+    except LookupError:
+        rows = len(src) if src is not None else len(key)
+        cols = len(dst) if dst is not None else len(key)
+        return [[0] * cols for _ in range(rows)]
+
+
+@lru_cache(maxsize=32)
+def _osrm_table_cached(
+    latlons: Tuple[Tuple[float, float], ...],
+    sources: Optional[Tuple[int, ...]],
+    destinations: Optional[Tuple[int, ...]],
+    timeout: int,
+) -> Tuple[Tuple[float, ...], ...]:
+    rows = _osrm_table(latlons, timeout, sources, destinations)
+    if rows is None:
+        raise LookupError("OSRM Table indisponível")
+    return tuple(map(tuple, rows))
+
+
+def _osrm_table_simetrica(latlons: Tuple[Tuple[float, float], ...], timeout: int) -> List[List[float]]:
+    """Monta a matriz completa a partir de blocos do triângulo superior.
+
+    Cada bloco de linhas ``i0..i1`` pede só as colunas ``i0..n-1``; com ``k``
+    blocos são ``n²/2 + n²/2k`` células em vez de ``n²``. Os blocos são
+    consultados em paralelo e memorizados como qualquer outra consulta.
+    Levanta ``LookupError`` se algum bloco falhar.
+    """
+    n = len(latlons)
+    parts = max(2, -(-n // OSRM_CHUNK))
+    bounds = sorted({round(k * n / parts) for k in range(parts + 1)})
+    blocks = list(zip(bounds, bounds[1:]))
+
+    def fetch_block(block: Tuple[int, int]):
+        i0, i1 = block
+        src = tuple(range(i0, i1))
+        dst = tuple(range(i0, n))
+        return i0, _osrm_table_cached(latlons, src, dst, timeout)
+
+    dist = np.zeros((n, n), dtype=np.float64)
+    with ThreadPoolExecutor(max_workers=min(POOL_SIZE, len(blocks))) as ex:
+        for i0, rows in ex.map(fetch_block, blocks):
+            dist[i0:i0 + len(rows), i0:] = rows
+    upper = np.triu(dist)
+    return (upper + np.triu(upper, 1).T).tolist()
+
+
+def _osrm_table(
+    latlons: Sequence[Tuple[float, float]],
+    timeout: int,
+    sources: Optional[Sequence[int]],
+    destinations: Optional[Sequence[int]],
+) -> Optional[List[List[float]]]:
+    """Consulta o OSRM Table; ``None`` indica falha."""
+    url = f"http://router.project-osrm.org/table/v1/foot/{osrm_coords(latlons)}"
     params = {"annotations": "distance"}
+    breaker = breaker_for(url)
+    if sources is not None or destinations is not None:
+        if sources is not None:
+            params["sources"] = ";".join(map(str, sources))
+        if destinations is not None:
+            params["destinations"] = ";".join(map(str, destinations))
+        try:
+            with breaker:
+                resp = session.get(url, params=params, timeout=timeout)
+                resp.raise_for_status()
+                return decode_distances(resp.content)
+        except (requests.RequestException, CircuitOpenError) as e:
+            log.error(f"Erro OSRM Table: {e}")
+        except Exception as e:
+            log.error(f"Erro ao processar resposta OSRM: {e}")
+        return None
     try:
-        resp = session.get(url, params=params, timeout=timeout)
-        resp.raise_for_status()
-        return resp.json().get("distances", [])
+        with breaker:
+            resp = session.get(url, params=params, timeout=timeout)
+            resp.raise_for_status()
+            return decode_distances(resp.content)
+    except CircuitOpenError as e:
+        log.error(f"Erro OSRM Table: {e}")
+        return None
     except requests.RequestException as e:
-        log.warning(f"OSRM Table falhou, tentando linha a linha: {e}")
+        log.warning(f"OSRM Table falhou, tentando em blocos: {e}")
 
         def fetch_row(i: int):
             try:
-                r = session.get(url, params={"annotations": "distance", "sources": i}, timeout=timeout)
-                r.raise_for_status()
-                return i, r.json().get("distances", [[0] * len(latlons)])[0]
+                with breaker:
+                    r = session.get(url, params={"annotations": "distance", "sources": i}, timeout=timeout)
+                    r.raise_for_status()
+                    return i, (decode_distances(r.content) or [[0] * len(latlons)])[0]
             except Exception as exc:
                 log.error(f"OSRM Table linha {i} falhou: {exc}")
                 return i, None
 
+        def fetch_chunk(chunk: List[int]):
+            if len(chunk) > 1:
+                sources = ";".join(map(str, chunk))
+                try:
+                    with breaker:
+                        r = session.get(
+                            url, params={"annotations": "distance", "sources": sources}, timeout=timeout
+                        )
+                        r.raise_for_status()
+                        rows = decode_distances(r.content)
+                    if len(rows) == len(chunk):
+                        return chunk, rows
+                    log.warning(f"OSRM Table bloco {chunk[0]}-{chunk[-1]} incompleto")
+                except Exception as exc:
+                    log.warning(f"OSRM Table bloco {chunk[0]}-{chunk[-1]} falhou: {exc}")
+            return chunk, [fetch_row(i)[1] for i in chunk]
+
+        # Matrizes pequenas vão direto para as linhas: um bloco repetiria a falha
+        size = OSRM_CHUNK if len(latlons) > OSRM_CHUNK else 1
+        chunks = [list(range(k, min(k + size, len(latlons)))) for k in range(0, len(latlons), size)]
         results = [None] * len(latlons)
-        with ThreadPoolExecutor(max_workers=min(4, len(latlons))) as ex:
-            futures = [ex.submit(fetch_row, i) for i in range(len(latlons))]
+        with ThreadPoolExecutor(max_workers=min(POOL_SIZE, len(chunks))) as ex:
+            futures = [ex.submit(fetch_chunk, c) for c in chunks]
             for fut in as_completed(futures):
-                idx, row = fut.result()
-                if row is None:
-                    return [[0] * len(latlons) for _ in latlons]
-                results[idx] = row
+                chunk, rows = fut.result()
+                for idx, row in zip(chunk, rows):
+                    if row is None:
+                        return None
+                    results[idx] = row
         return results
     except Exception as e:
         log.error(f"Erro ao processar resposta OSRM: {e}")
-        return [[0] * len(latlons) for _ in latlons]
+        return None
 
-__all__ = ["coletar_pois", "batch_altitude", "osrm_table", "session"]
+__all__ = [
+    "coletar_pois",
+    "overpass_query",
+    "candidato_poi",
+    "selecionar_pois",
+    "batch_altitude",
+    "osrm_table",
+    "osrm_coords",
+    "decode_polyline",
+    "session",
+]
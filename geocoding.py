@@ -1,21 +1,58 @@
 import logging
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Optional, Tuple, Any
+from typing import Any, List, Optional, Sequence, Tuple
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 try:  # Shapely é opcional
+    import shapely
     from shapely.geometry import Polygon, Point
+    from shapely.geometry.base import BaseGeometry
 except Exception:  # pragma: no cover - biblioteca ausente
+    shapely = None  # type: ignore
     Polygon = None  # type: ignore
     Point = None  # type: ignore
+    BaseGeometry = None  # type: ignore
+
+try:  # rapidfuzz é opcional
+    from rapidfuzz import fuzz, process as fuzz_process
+except Exception:  # pragma: no cover - biblioteca ausente
+    fuzz = None  # type: ignore
+    fuzz_process = None  # type: ignore
 
 from geopy.geocoders import Nominatim, Photon
 from geopy.extra.rate_limiter import RateLimiter
 from geopy.exc import GeocoderTimedOut
 
+from reliability import breaker_for
+from singleflight import coalesce
+
 log = logging.getLogger(__name__)
 
+# Tamanho do pool de conexões keep-alive por host
+POOL_SIZE = 32
+
+# Sessao HTTP com retries, compartilhada por todas as chamadas às APIs
+session = requests.Session()
+session.headers.update({"Connection": "keep-alive", "User-Agent": "rotadebares/1.0"})
+retries = Retry(total=5, backoff_factor=1, status_forcelist=[502,504,522,524], allowed_methods=["GET","POST"])
+adapter = HTTPAdapter(
+    max_retries=retries, pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, pool_block=False
+)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
 # Inicializa geocoders e cache
 geolocator = Nominatim(user_agent="tsp_app", timeout=10)
 photon = Photon(user_agent="tsp_app", timeout=10)
@@ -24,35 +61,128 @@ _city_geolocator = Nominatim(user_agent="tsp_app_bbox", timeout=10)
 geocode_rl = RateLimiter(geolocator.geocode, min_delay_seconds=1)
 photon_geocode_rl = RateLimiter(photon.geocode, min_delay_seconds=1)
 
-_cache_geo = {}
+# Tempo de vida das entradas do cache persistente (30 dias)
+GEO_CACHE_TTL = 30 * 86400
+# Similaridade mínima (0-100) para reaproveitar um endereço já geocodificado
+FUZZY_MIN_SCORE = 92
+# Números (de porta, de quadra...) que precisam coincidir no casamento aproximado
+_NUMEROS = re.compile(r"\d+")
+_MISSING = object()
+
+
+class _GeoCache:
+    """Cache chave/valor persistido em SQLite com expiração por TTL.
+
+    Os valores são serializados com ``pickle``; ``None`` é um valor válido, o
+    que permite guardar buscas negativas e evitar repeti-las.
+    """
+
+    def __init__(self, path: str, ttl: float = GEO_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+        except sqlite3.Error as e:  # pragma: no cover - disco indisponível
+            log.warning(f"Cache de geocoding em memória ({path}: {e})")
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Retorna o valor de ``key`` ou ``default`` se ausente/expirado."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value: Any) -> Any:
+        """Grava ``value`` em ``key`` e o retorna."""
+        blob = pickle.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                (key, blob, time.time() + self.ttl),
+            )
+        return value
+
+    def items(self, prefix: str) -> List[Tuple[str, Any]]:
+        """Lista os pares ``(chave, valor)`` válidos cujas chaves começam com ``prefix``."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM cache WHERE key >= ? AND key < ? AND expires >= ?",
+                (prefix, prefix + "\U0010ffff", time.time()),
+            ).fetchall()
+        return [(k, pickle.loads(v)) for k, v in rows]
+
+    def clear(self) -> None:
+        """Remove todas as entradas."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+
+_cache_geo = _GeoCache(os.environ.get("ROTADEBARES_GEO_CACHE", ".geo_cache.sqlite"))
 
 
 @lru_cache(maxsize=64)
 def get_city_area_id(city_name: str) -> Optional[int]:
     """Retorna o ``area id`` da cidade no Overpass."""
+    key = f"area|{city_name}"
+    hit = _cache_geo.get(key, _MISSING)
+    if hit is not _MISSING:
+        return hit
     q = f"""
     [out:json][timeout:25];
     rel["name"="{city_name}"]["boundary"="administrative"]["admin_level"="8"];out ids;
     """
     try:
-        resp = requests.post(
-            "http://overpass-api.de/api/interpreter", data={"data": q}, timeout=25
-        )
-        resp.raise_for_status()
-        elements = resp.json().get("elements", [])
-        if elements:
-            rel_id = elements[0]["id"]
-            return 3600000000 + rel_id
+        with breaker_for(OVERPASS_URL):
+            resp = session.post(OVERPASS_URL, data={"data": q}, timeout=25)
+            resp.raise_for_status()
+            elements = resp.json().get("elements", [])
     except Exception as e:  # pragma: no cover - log apenas
         log.error(f"Erro ao obter area id: {e}")
-    return None
+        return None
+    if elements:
+        return _cache_geo.set(key, 3600000000 + elements[0]["id"])
+    return _cache_geo.set(key, None)
+
+
+def _preparar(poly: Any) -> Any:
+    """Prepara o polígono para testes de contenção repetidos.
+
+    A geometria preparada mantém um índice interno no GEOS, de modo que cada
+    ``contains`` não precisa percorrer todos os vértices do anel.
+    """
+    if poly is None:
+        return None
+    if hasattr(shapely, "prepare"):
+        shapely.prepare(poly)
+        return poly
+    from shapely.prepared import prep  # Shapely < 2
+
+    return prep(poly)
 
 
 @lru_cache(maxsize=64)
 def get_city_polygon(city_name: str) -> Optional[Any]:
-    """Obtém o polígono da cidade como ``Polygon`` do Shapely."""
+    """Obtém o polígono (preparado) da cidade como ``Polygon`` do Shapely."""
     if Polygon is None:
         return None
+    key = f"poly|{city_name}"
+    hit = _cache_geo.get(key, _MISSING)
+    if hit is not _MISSING:
+        return _preparar(hit)
     area_id = get_city_area_id(city_name)
     if not area_id:
         return None
@@ -62,16 +192,14 @@ def get_city_polygon(city_name: str) -> Optional[Any]:
     rel(area.a)[boundary="administrative"][admin_level="8"];out geom;
     """
     try:
-        resp = requests.post(
-            "http://overpass-api.de/api/interpreter", data={"data": q}, timeout=25
-        )
-        resp.raise_for_status()
-        elements = resp.json().get("elements", [])
+        with breaker_for(OVERPASS_URL):
+            resp = session.post(OVERPASS_URL, data={"data": q}, timeout=25)
+            resp.raise_for_status()
+            elements = resp.json().get("elements", [])
         if not elements:
-            return None
+            return _cache_geo.set(key, None)
         coords = [(p["lon"], p["lat"]) for p in elements[0].get("geometry", [])]
-        if coords:
-            return Polygon(coords)
+        return _preparar(_cache_geo.set(key, Polygon(coords) if coords else None))
     except Exception as e:  # pragma: no cover - log apenas
         log.error(f"Erro ao obter polígono: {e}")
     return None
@@ -82,49 +210,131 @@ def point_in_polygon(lat: float, lon: float, poly: Any) -> bool:
     if not poly or Point is None:
         return True
     try:
+        if hasattr(shapely, "contains_xy") and isinstance(poly, BaseGeometry):
+            # Shapely >= 2: evita alocar um ``Point`` GEOS por chamada
+            return bool(shapely.contains_xy(poly, lon, lat))
         return bool(poly.contains(Point(lon, lat)))
     except Exception:  # pragma: no cover - errors ignorados
         return True
 
 
+def points_in_polygon(lats: np.ndarray, lons: np.ndarray, poly: Any) -> np.ndarray:
+    """Versão vetorizada de :func:`point_in_polygon`.
+
+    Usa ``shapely.contains_xy`` para testar todos os pontos em uma única
+    chamada ao GEOS; outros objetos com ``contains`` são testados ponto a
+    ponto.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if not poly or Point is None:
+        return np.ones(lats.shape, dtype=bool)
+    if hasattr(shapely, "contains_xy") and isinstance(poly, BaseGeometry):
+        return np.asarray(shapely.contains_xy(poly, lons, lats), dtype=bool)
+    return np.fromiter(
+        (point_in_polygon(lat, lon, poly) for lat, lon in zip(lats, lons)),
+        dtype=bool,
+        count=len(lats),
+    )
+
+
 @lru_cache(maxsize=64)
 def get_city_bbox(city_name: str) -> Optional[Tuple[float, float, float, float]]:
     """Retorna a bounding box (sul, norte, oeste, leste) da cidade."""
+    key = f"bbox|{city_name}"
+    hit = _cache_geo.get(key, _MISSING)
+    if hit is not _MISSING:
+        return hit
     loc = _city_geolocator.geocode(
         {"city": city_name, "state": "Minas Gerais", "country": "Brazil"},
         exactly_one=True,
     )
     if not loc or "boundingbox" not in loc.raw:
-        return None
+        return _cache_geo.set(key, None)
     sb, nb, wb, eb = loc.raw["boundingbox"]
-    return float(sb), float(nb), float(wb), float(eb)
+    return _cache_geo.set(key, (float(sb), float(nb), float(wb), float(eb)))
 
 
-def dentro_da_cidade(lat: float, lon: float, bbox: Tuple[float, float, float, float]) -> bool:
+def dentro_da_cidade(lat: Any, lon: Any, bbox: Tuple[float, float, float, float]) -> Any:
     """Verifica se a coordenada esta dentro dos limites da ``bbox``.
 
+    A comparação é feita sem desvios (``&`` em vez de ``and``), de modo que
+    ``lat`` e ``lon`` podem ser escalares ou arrays NumPy.
+
     Parameters
     ----------
     lat, lon:
-        Coordenadas a validar.
+        Coordenadas a validar (escalares ou arrays de mesmo formato).
     bbox:
         Limites da cidade (sul, norte, oeste, leste).
 
     Returns
     -------
-    bool
-        ``True`` se a coordenada estiver dentro da ``bbox``.
+    bool | numpy.ndarray
+        ``True`` (ou máscara booleana) se a coordenada estiver dentro da ``bbox``.
     """
 
     s, n, w, e = bbox
-    return s <= lat <= n and w <= lon <= e
+    return (lat >= s) & (lat <= n) & (lon >= w) & (lon <= e)
+
+
+@lru_cache(maxsize=1024)
+def normalizar_nome(nome: str) -> str:
+    """Remove acentos e diferenças de caixa de ``nome`` para comparações."""
+    sem_acento = unicodedata.normalize("NFKD", nome).encode("ascii", "ignore").decode()
+    return sem_acento.casefold()
+
+
+def mascara_cidade(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    bbox: Optional[Tuple[float, float, float, float]],
+    poly: Any,
+) -> np.ndarray:
+    """Máscara booleana dos pontos dentro da cidade.
+
+    Usa o polígono quando disponível e, na falta dele, a ``bbox``. Todas as
+    coordenadas são avaliadas de uma vez como arrays NumPy.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if poly:
+        return points_in_polygon(lats, lons, poly)
+    if bbox:
+        return dentro_da_cidade(lats, lons, bbox)
+    return np.ones(lats.shape, dtype=bool)
+
+
+def _norm(s: str) -> str:
+    """Normaliza espaços e caixa de ``s`` para uso em chaves de cache."""
+    return re.sub(r"\s+", " ", s.strip().casefold())
 
 
+def _validar(loc: Any, city: str, bbox: Optional[Tuple[float, float, float, float]], poly: Any) -> Any:
+    """Valida um resultado de geocoding contra a cidade.
+
+    Retorna ``(lat, lon)`` quando aceito, ``None`` quando rejeitado pela tag
+    de cidade ou pelo polígono e ``_MISSING`` quando não há resultado dentro
+    da ``bbox`` (o chamador pode tentar outro serviço).
+    """
+    if not loc or (bbox and not dentro_da_cidade(loc.latitude, loc.longitude, bbox)):
+        return _MISSING
+    addr = loc.raw.get("address", {})
+    ctag = addr.get("city") or addr.get("town") or addr.get("village")
+    if ctag and normalizar_nome(ctag) != normalizar_nome(city):
+        return None
+    if not point_in_polygon(loc.latitude, loc.longitude, poly):
+        return None
+    return (loc.latitude, loc.longitude)
+
+
+@coalesce(lambda address, city: ("strict", _norm(address), _norm(city)))
 def geocode_strict_single(address: str, city: str) -> Optional[Tuple[float, float]]:
     """Geocoding restrito à cidade usando viewbox."""
-    key = f"strict|{address}|{city}"
-    if key in _cache_geo:
-        return _cache_geo[key]
+    key = f"strict|{_norm(address)}|{_norm(city)}"
+    hit = _cache_geo.get(key, _MISSING)
+    if hit is not _MISSING:
+        return hit
     bbox = get_city_bbox(city)
     poly = get_city_polygon(city)
     params = {"street": address, "city": city, "state": "Minas Gerais", "country": "Brazil"}
@@ -135,61 +345,124 @@ def geocode_strict_single(address: str, city: str) -> Optional[Tuple[float, floa
             loc = geocode_rl(params, exactly_one=True, viewbox=viewbox, bounded=True)
         else:
             loc = geocode_rl(params, exactly_one=True)
-        if loc and (not bbox or dentro_da_cidade(loc.latitude, loc.longitude, bbox)):
-            addr = loc.raw.get("address", {})
-            ctag = addr.get("city") or addr.get("town") or addr.get("village")
-            if ctag and ctag.lower() != city.lower():
-                return None
-            if not point_in_polygon(loc.latitude, loc.longitude, poly):
-                return None
-            return _cache_geo.setdefault(key, (loc.latitude, loc.longitude))
     except GeocoderTimedOut:
-        pass
-    return None
+        return None
+    result = _validar(loc, city, bbox, poly)
+    return _cache_geo.set(key, None if result is _MISSING else result)
+
 
+def _buscar_similar(address: str, city: str) -> Optional[Tuple[float, float]]:
+    """Procura no cache um endereço já resolvido quase idêntico a ``address``.
 
+    Compara com as entradas ``strict`` positivas da mesma cidade via
+    ``rapidfuzz``; requer similaridade mínima de ``FUZZY_MIN_SCORE``. Só são
+    candidatos endereços com exatamente os mesmos números (``"100"`` nunca
+    casa com ``"180"`` ou ``"10"``), e apenas a parte textual é pontuada.
+    """
+    if fuzz_process is None:
+        return None
+    alvo = _norm(address)
+    numeros = _NUMEROS.findall(alvo)
+    prefixo, sufixo = "strict|", f"|{_norm(city)}"
+    known = {}
+    for k, v in _cache_geo.items(prefixo):
+        if not (k.endswith(sufixo) and v):
+            continue
+        endereco = k[len(prefixo):-len(sufixo)]
+        if _NUMEROS.findall(endereco) == numeros:
+            known[_norm(_NUMEROS.sub(" ", endereco))] = v
+    if not known:
+        return None
+    match = fuzz_process.extractOne(
+        _norm(_NUMEROS.sub(" ", alvo)),
+        list(known),
+        scorer=fuzz.token_sort_ratio,
+        score_cutoff=FUZZY_MIN_SCORE,
+    )
+    return known[match[0]] if match else None
+
+
+@coalesce(lambda address, city: ("fallback", _norm(address), _norm(city)))
 def geocode_fallback_single(address: str, city: str) -> Optional[Tuple[float, float]]:
     """Geocoding de fallback usando Nominatim e Photon."""
-    key = f"fallback|{address}|{city}"
-    if key in _cache_geo:
-        return _cache_geo[key]
+    key = f"fallback|{_norm(address)}|{_norm(city)}"
+    hit = _cache_geo.get(key, _MISSING)
+    if hit is not _MISSING:
+        return hit
     bbox = get_city_bbox(city)
     poly = get_city_polygon(city)
+    failed = False
     try:
         loc = geocode_rl(
             {"street": address, "city": city, "state": "Minas Gerais", "country": "Brazil"},
             exactly_one=True,
         )
-        if loc and (not bbox or dentro_da_cidade(loc.latitude, loc.longitude, bbox)):
-            addr = loc.raw.get("address", {})
-            ctag = addr.get("city") or addr.get("town") or addr.get("village")
-            if ctag and ctag.lower() != city.lower():
-                return None
-            if not point_in_polygon(loc.latitude, loc.longitude, poly):
-                return None
-            return _cache_geo.setdefault(key, (loc.latitude, loc.longitude))
+        result = _validar(loc, city, bbox, poly)
+        if result is not _MISSING:
+            return _cache_geo.set(key, result)
     except Exception:
-        pass
+        failed = True
+    similar = _buscar_similar(address, city)
+    if similar:
+        return _cache_geo.set(key, similar)
     try:
         loc2 = photon_geocode_rl(f"{address}, {city}, MG, Brazil", exactly_one=True)
-        if loc2 and (not bbox or dentro_da_cidade(loc2.latitude, loc2.longitude, bbox)):
-            addr = loc2.raw.get("address", {})
-            ctag = addr.get("city") or addr.get("town") or addr.get("village")
-            if ctag and ctag.lower() != city.lower():
-                return None
-            if not point_in_polygon(loc2.latitude, loc2.longitude, poly):
-                return None
-            return _cache_geo.setdefault(key, (loc2.latitude, loc2.longitude))
+        result = _validar(loc2, city, bbox, poly)
+        if result is not _MISSING:
+            return _cache_geo.set(key, result)
     except Exception:
-        pass
-    return None
+        failed = True
+    # Falhas de rede não são gravadas para permitir nova tentativa
+    return None if failed else _cache_geo.set(key, None)
+
+@lru_cache(maxsize=1024)
+def _geocode_cached(address: str, city: str) -> Tuple[float, float]:
+    """Memoriza no processo os endereços já resolvidos (falhas não são guardadas)."""
+    geo = geocode_strict_single(address, city) or geocode_fallback_single(address, city)
+    if geo is None:
+        raise LookupError(address)
+    return geo
+
+
+def geocode_single(address: str, city: str) -> Optional[Tuple[float, float]]:
+    """Geocodifica ``address`` na cidade, recorrendo ao fallback se necessário."""
+    try:
+        return _geocode_cached(address, city)
+    except LookupError:
+        return None
+
+
+def geocode_batch(queries: Sequence[str], city: str, max_workers: int = 8) -> List[Optional[Tuple[float, float]]]:
+    """Geocodifica vários endereços da mesma cidade de uma vez.
+
+    Endereços repetidos são resolvidos uma única vez e os distintos em
+    paralelo; o resultado segue a ordem de ``queries``. As chamadas ao
+    Nominatim continuam espaçadas pelo ``RateLimiter``.
+    """
+    unique = list(dict.fromkeys(queries))
+    if not unique:
+        return []
+    # Contexto da cidade resolvido antes do pool: o ``lru_cache`` não junta
+    # falhas de cache simultâneas, e cada worker consultaria Nominatim e
+    # Overpass em paralelo, fora do ``RateLimiter``
+    get_city_bbox(city)
+    get_city_polygon(city)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+        found = dict(zip(unique, pool.map(lambda q: geocode_single(q, city), unique)))
+    return [found[q] for q in queries]
+
 
 __all__ = [
     "get_city_area_id",
     "get_city_polygon",
     "point_in_polygon",
+    "points_in_polygon",
     "get_city_bbox",
     "dentro_da_cidade",
+    "mascara_cidade",
+    "normalizar_nome",
     "geocode_strict_single",
     "geocode_fallback_single",
+    "geocode_single",
+    "geocode_batch",
 ]
@@ -1,27 +1,25 @@
+import hashlib
 import logging
+import os
+import weakref
+from functools import lru_cache
 from typing import List, Tuple
 
 import folium
 import requests
 
-from data_fetch import session
+try:  # orjson é opcional
+    from orjson import loads as json_loads
+except Exception:  # pragma: no cover - biblioteca ausente
+    from json import loads as json_loads
+
+from data_fetch import decode_polyline, osrm_coords, session
+from reliability import CircuitOpenError, breaker_for
 
 log = logging.getLogger(__name__)
 
-
-def fetch_route_geometry(a: Tuple[float, float], b: Tuple[float, float]) -> List[Tuple[float, float]]:
-    """Busca linha de caminho entre dois pontos via OSRM."""
-    url = f"http://router.project-osrm.org/route/v1/foot/{a[1]},{a[0]};{b[1]},{b[0]}"
-    try:
-        resp = session.get(url, params={"overview": "full", "geometries": "geojson"}, timeout=30)
-        resp.raise_for_status()
-        coords = resp.json()["routes"][0]["geometry"]["coordinates"]
-        return [(lat, lng) for lng, lat in coords]
-    except requests.RequestException as e:
-        log.error(f"Erro OSRM Route: {e}")
-    except Exception as e:
-        log.error(f"Erro ao processar resposta OSRM Route: {e}")
-    return []
+# HTML dos marcadores numerados das paradas
+_DIV_TEMPLATE = '<div style="background:#FF5722;color:#fff;border-radius:50%;padding:6px;">{seq}</div>'
 
 
 def fetch_route_geometry_multi(points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
@@ -38,23 +36,50 @@ def fetch_route_geometry_multi(points: List[Tuple[float, float]]) -> List[Tuple[
         Coordenadas da linha da rota no formato ``(lat, lon)``.
     """
 
-    coord_str = ";".join(f"{lon},{lat}" for lat, lon in points)
-    url = f"http://router.project-osrm.org/route/v1/foot/{coord_str}"
+    # Chave em micrograus: mesma precisão das coordenadas enviadas ao OSRM
+    key = tuple((round(lat * 1e6), round(lon * 1e6)) for lat, lon in points)
     try:
-        resp = session.get(url, params={"overview": "full", "geometries": "geojson"}, timeout=30)
-        resp.raise_for_status()
-        coords = resp.json()["routes"][0]["geometry"]["coordinates"]
-        return [(lat, lng) for lng, lat in coords]
-    except requests.RequestException as e:
+        return list(_fetch_route_cached(key))
+    except (requests.RequestException, CircuitOpenError) as e:
         log.error(f"Erro OSRM Route múltiplo: {e}")
     except Exception as e:
         log.error(f"Erro ao processar resposta OSRM Route múltiplo: {e}")
     return []
 
 
+@lru_cache(maxsize=128)
+def _fetch_route_cached(key: Tuple[Tuple[int, int], ...]) -> Tuple[Tuple[float, float], ...]:
+    """Consulta o OSRM Route para ``key``; exceções não são memorizadas."""
+    points = [(lat / 1e6, lon / 1e6) for lat, lon in key]
+    url = f"http://router.project-osrm.org/route/v1/foot/{osrm_coords(points)}"
+    with breaker_for(url):
+        resp = session.get(url, params={"overview": "full", "geometries": "polyline6"}, timeout=30)
+        resp.raise_for_status()
+        geometry = json_loads(resp.content)["routes"][0]["geometry"]
+    return tuple(decode_polyline(geometry))
+
+
+def fetch_route_geometry(a: Tuple[float, float], b: Tuple[float, float]) -> List[Tuple[float, float]]:
+    """Busca linha de caminho entre dois pontos via OSRM."""
+    return fetch_route_geometry_multi([a, b])
+
+
+class _RotaIncompleta(LookupError):
+    """Mapa montado sem a linha da rota; não deve ser memorizado."""
+
+    def __init__(self, mapa: folium.Map) -> None:
+        super().__init__("geometria da rota indisponível")
+        self.mapa = mapa
+
+
 def build_map(route_idx: List[int], coords: List[Tuple[float, float, float]], names: List[str]) -> folium.Map:
     """Monta o mapa interativo da rota.
 
+    Mapas com a linha da rota completa são memorizados pela rota,
+    coordenadas e nomes: repetir o cálculo devolve o mesmo objeto, que não
+    deve ser alterado pelo chamador. Se a geometria falhar o mapa traz só os
+    marcadores e é refeito na próxima chamada.
+
     Parameters
     ----------
     route_idx:
@@ -70,18 +95,72 @@ def build_map(route_idx: List[int], coords: List[Tuple[float, float, float]], na
         Mapa com marcadores e a linha da rota.
     """
 
+    key = tuple(tuple(map(float, c)) for c in coords)
+    try:
+        return _build_map_cached(tuple(route_idx), key, tuple(names))
+    except _RotaIncompleta as e:
+        return e.mapa
+
+
+@lru_cache(maxsize=8)
+def _build_map_cached(
+    route_idx: Tuple[int, ...],
+    coords: Tuple[Tuple[float, ...], ...],
+    names: Tuple[str, ...],
+) -> folium.Map:
     m = folium.Map(location=coords[0][:2], zoom_start=14)
-    folium.Marker(coords[0][:2], tooltip="Partida", icon=folium.Icon(color="green", icon="play")).add_to(m)
+    # Todos os marcadores ficam em uma única camada adicionada ao mapa
+    fg = folium.FeatureGroup(name="rota")
+    fg.add_child(folium.Marker(coords[0][:2], tooltip="Partida", icon=folium.Icon(color="green", icon="play")))
     for seq, idx in enumerate(route_idx[1:-1], start=1):
-        folium.Marker(
+        fg.add_child(folium.Marker(
             coords[idx][:2],
             tooltip=f"{seq}. {names[idx]}",
-            icon=folium.DivIcon(html=f'<div style="background:#FF5722;color:#fff;border-radius:50%;padding:6px;">{seq}</div>'),
-        ).add_to(m)
-    folium.Marker(coords[route_idx[-1]][:2], tooltip="Destino", icon=folium.Icon(color="red", icon="flag")).add_to(m)
+            icon=folium.DivIcon(html=_DIV_TEMPLATE.format(seq=seq)),
+        ))
+    fg.add_child(folium.Marker(coords[route_idx[-1]][:2], tooltip="Destino", icon=folium.Icon(color="red", icon="flag")))
+    fg.add_to(m)
     ordered = [coords[i][:2] for i in route_idx]
     full_route = fetch_route_geometry_multi(ordered)
+    if not full_route:
+        raise _RotaIncompleta(m)
     folium.PolyLine(full_route, weight=4, opacity=0.7).add_to(m)
     return m
 
-__all__ = ["fetch_route_geometry", "fetch_route_geometry_multi", "build_map"]
+
+# Resumo BLAKE2b do último HTML gravado em cada caminho
+_saved_digests: dict = {}
+# HTML já renderizado (em UTF-8) de cada mapa: renderizar o mesmo
+# ``folium.Map`` de novo repete os scripts no documento, além de refazer todo
+# o template
+_rendered: "weakref.WeakKeyDictionary[folium.Map, Tuple[bytes, bytes]]" = weakref.WeakKeyDictionary()
+
+
+def save_map(m: folium.Map, filename: str) -> bool:
+    """Grava o HTML de ``m`` em ``filename`` se o conteúdo mudou.
+
+    Cada mapa é renderizado e codificado em UTF-8 uma única vez; os mesmos
+    bytes servem ao resumo BLAKE2b e a todas as gravações. Se o resumo for
+    igual ao do último HTML gravado no mesmo caminho (e o arquivo ainda
+    existir) a escrita é evitada.
+
+    Returns
+    -------
+    bool
+        ``True`` se o arquivo foi escrito.
+    """
+
+    if m not in _rendered:
+        html = m.get_root().render().encode("utf-8")
+        _rendered[m] = html, hashlib.blake2b(html, digest_size=16).digest()
+    html, digest = _rendered[m]
+    path = os.path.abspath(filename)
+    if _saved_digests.get(path) == digest and os.path.exists(path):
+        return False
+    with open(path, "wb") as f:
+        f.write(html)
+    _saved_digests[path] = digest
+    return True
+
+
+__all__ = ["fetch_route_geometry", "fetch_route_geometry_multi", "build_map", "save_map"]
@@ -1,11 +1,121 @@
-from typing import List, Tuple
+import hashlib
+from collections import deque
+from functools import lru_cache
+from typing import Any, List, Tuple
 
 import networkx as nx
+import numpy as np
+
+try:  # SciPy é opcional
+    from scipy.sparse.csgraph import minimum_spanning_tree
+except Exception:  # pragma: no cover - biblioteca ausente
+    minimum_spanning_tree = None
+
+try:  # Numba é opcional
+    from numba import njit, prange
+except Exception:  # pragma: no cover - biblioteca ausente
+    njit = None
+    prange = range
 
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 
 
-def solve_tsp(dist_matrix: List[List[float]], start: int, end: int, time_limit_s: int = 5) -> List[int] | None:
+# Fator aplicado às distâncias antes de convertê-las para os custos inteiros
+# do OR-Tools (metros -> milímetros)
+SCALE = 1000
+# Custo finito (10.000 km) dos pares sem rota: o OSRM devolve ``null``, que vira
+# NaN no NumPy e um custo inteiro negativo enorme se convertido diretamente
+UNREACHABLE = 1e7
+
+
+def finite_distances(dist_matrix: List[List[float | None]] | np.ndarray) -> np.ndarray:
+    """Matriz ``float64`` com ``None``/NaN/infinitos trocados por ``UNREACHABLE``."""
+    return np.nan_to_num(
+        np.asarray(dist_matrix, dtype=np.float64),
+        nan=UNREACHABLE,
+        posinf=UNREACHABLE,
+        neginf=UNREACHABLE,
+    )
+
+
+def _int_matrix(dist_matrix: List[List[float]] | np.ndarray) -> np.ndarray:
+    """Converte a matriz para ``int64`` contígua em ``1/SCALE`` da unidade original.
+
+    Os valores são multiplicados por ``SCALE`` e arredondados, preservando
+    as frações que o truncamento por ``int()`` descartaria. Pares sem rota
+    (valores não finitos) custam ``UNREACHABLE``.
+    """
+    scaled = np.rint(finite_distances(dist_matrix) * SCALE)
+    return np.ascontiguousarray(scaled, dtype=np.int64)
+
+
+class _Matriz:
+    """Matriz ``float64`` usada como chave de cache pela sua impressão digital.
+
+    Hash e igualdade comparam apenas forma e resumo BLAKE2b dos bytes, bem
+    mais baratos que converter a matriz em tuplas para o ``lru_cache``.
+    """
+
+    __slots__ = ("array", "_chave")
+
+    def __init__(self, dist_matrix: List[List[float]] | np.ndarray) -> None:
+        self.array = np.ascontiguousarray(dist_matrix, dtype=np.float64)
+        digest = hashlib.blake2b(self.array.data, digest_size=16).digest()
+        self._chave = (self.array.shape, digest)
+
+    def __hash__(self) -> int:
+        return hash(self._chave)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Matriz) and self._chave == other._chave
+
+
+@lru_cache(maxsize=8)
+def _int_rows(matrix: _Matriz) -> List[List[int]]:
+    """Linhas inteiras de ``matrix``, memorizadas entre os solvers (não alterar)."""
+    return _int_matrix(matrix.array).tolist()
+
+
+def _registrar_distancias(routing: Any, dist_matrix: List[List[float]] | np.ndarray) -> int:
+    """Registra o custo dos arcos no ``routing`` e devolve o índice do trânsito.
+
+    A matriz inteira é entregue ao OR-Tools com ``RegisterTransitMatrix`` e
+    fica armazenada em C++; a conversão índice -> nó também é feita lá, sem
+    nenhum callback Python durante a busca. A conversão para inteiros é
+    memorizada, de modo que rodar vários solvers na mesma matriz a faz uma
+    única vez.
+    """
+    return routing.RegisterTransitMatrix(_int_rows(_Matriz(dist_matrix)))
+
+
+def _parametros(time_limit_s: int, first_solution_strategy: int | None = None) -> Any:
+    """Parâmetros de busca comuns aos solvers do OR-Tools.
+
+    Fixa explicitamente as opções leves (sem log, sem propagação completa e
+    apenas a melhor solução guardada), ativa a seleção de operadores por
+    *multi-armed bandit* e usa ``AUTOMATIC`` como estratégia de solução
+    inicial quando ``first_solution_strategy`` é ``None``.
+    """
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    if first_solution_strategy is None:
+        first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC
+    params.first_solution_strategy = first_solution_strategy
+    params.log_search = False
+    params.use_full_propagation = False
+    params.number_of_solutions_to_collect = 1
+    # Escolhe adaptativamente os operadores de vizinhança mais produtivos
+    params.use_multi_armed_bandit_concatenate_operators = True
+    params.time_limit.seconds = time_limit_s
+    return params
+
+
+def solve_tsp(
+    dist_matrix: List[List[float]],
+    start: int,
+    end: int,
+    time_limit_s: int = 5,
+    first_solution_strategy: int | None = None,
+) -> List[int] | None:
     """Resolve o TSP fixando inicio e fim.
 
     Parameters
@@ -18,6 +128,9 @@ def solve_tsp(dist_matrix: List[List[float]], start: int, end: int, time_limit_s
         Índice do destino final.
     time_limit_s:
         Tempo limite de busca em segundos.
+    first_solution_strategy:
+        Valor de ``routing_enums_pb2.FirstSolutionStrategy``; ``None`` usa
+        ``AUTOMATIC``.
 
     Returns
     -------
@@ -28,15 +141,10 @@ def solve_tsp(dist_matrix: List[List[float]], start: int, end: int, time_limit_s
     mgr = pywrapcp.RoutingIndexManager(n, 1, [start], [end])
     routing = pywrapcp.RoutingModel(mgr)
 
-    def cb(i, j):
-        return int(dist_matrix[mgr.IndexToNode(i)][mgr.IndexToNode(j)])
-
-    idx = routing.RegisterTransitCallback(cb)
+    idx = _registrar_distancias(routing, dist_matrix)
     routing.SetArcCostEvaluatorOfAllVehicles(idx)
 
-    params = pywrapcp.DefaultRoutingSearchParameters()
-    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    params.time_limit.seconds = time_limit_s
+    params = _parametros(time_limit_s, first_solution_strategy)
 
     sol = routing.SolveWithParameters(params)
     if not sol:
@@ -50,38 +158,68 @@ def solve_tsp(dist_matrix: List[List[float]], start: int, end: int, time_limit_s
     route.append(mgr.IndexToNode(index))
     return route
 
-__all__ = ["solve_tsp", "apply_elevation_penalty"]
+__all__ = ["solve_tsp", "apply_elevation_penalty", "finite_distances", "UNREACHABLE"]
+
+
+if njit is not None:
+
+    @njit(cache=True, parallel=True, fastmath=True)
+    def _apply_elev(dist, alts, weight):  # pragma: no cover - compilado pelo Numba
+        """Soma a penalidade de subida em ``dist`` (in-place), linhas em paralelo."""
+        n = dist.shape[0]
+        for i in prange(n):
+            for j in range(n):
+                gain = alts[j] - alts[i]
+                if gain > 0:
+                    dist[i, j] += gain * weight
+        return dist
 
 
 def apply_elevation_penalty(
-    dist_matrix: List[List[float]],
+    dist_matrix: List[List[float]] | np.ndarray,
     coords: List[Tuple[float, float, float]],
     weight: float,
-) -> List[List[float]]:
+    copy: bool = True,
+) -> List[List[float]] | np.ndarray:
     """Aplica penalidade de subida na matriz de distâncias.
 
     Para cada par ``i -> j`` adiciona ``weight * max(0, alt_j - alt_i)`` ao
-    valor original da matriz.
+    valor original da matriz. O resultado é um ``ndarray`` ``float64`` (a
+    diagonal não muda, pois o ganho é zero). Com Numba disponível o cálculo é
+    feito por um kernel compilado que percorre a matriz uma única vez, sem a
+    matriz temporária de ganhos; sem ele usa *broadcasting* do NumPy.
+
+    Com ``copy=False`` uma matriz ``float64`` recebida como ``ndarray`` é
+    modificada in-place e retornada, evitando a cópia n x n; outras entradas
+    são convertidas para um novo array de qualquer forma.
     """
 
     if weight <= 0:
         return dist_matrix
 
-    n = len(dist_matrix)
-    alts = [c[2] for c in coords]
-    penal = [row[:] for row in dist_matrix]
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                continue
-            gain = alts[j] - alts[i]
-            if gain > 0:
-                penal[i][j] += gain * weight
+    alts = np.fromiter((c[2] for c in coords), dtype=np.float64, count=len(coords))
+    # No máximo uma cópia contígua; a penalidade é somada nela in-place
+    # (``copy=None`` em ``np.array`` só existe a partir do NumPy 2)
+    if copy:
+        penal = np.array(dist_matrix, dtype=np.float64)
+    else:
+        penal = np.ascontiguousarray(dist_matrix, dtype=np.float64)
+    if njit is not None:
+        _apply_elev(penal, alts, float(weight))
+        return penal
+    gain = alts[None, :] - alts[:, None]
+    np.maximum(gain, 0.0, out=gain)
+    gain *= weight
+    penal += gain
     return penal
 
 
 def solve_tsp_guided_local_search(
-    dist_matrix: List[List[float]], start: int, end: int, time_limit_s: int = 5
+    dist_matrix: List[List[float]],
+    start: int,
+    end: int,
+    time_limit_s: int = 5,
+    first_solution_strategy: int | None = None,
 ) -> List[int] | None:
     """Resolve o TSP usando GUIDED_LOCAL_SEARCH do OR-Tools.
 
@@ -95,6 +233,9 @@ def solve_tsp_guided_local_search(
         Índice do destino final.
     time_limit_s:
         Tempo limite de busca em segundos.
+    first_solution_strategy:
+        Valor de ``routing_enums_pb2.FirstSolutionStrategy``; ``None`` usa
+        ``AUTOMATIC``.
 
     Returns
     -------
@@ -106,18 +247,23 @@ def solve_tsp_guided_local_search(
     mgr = pywrapcp.RoutingIndexManager(n, 1, [start], [end])
     routing = pywrapcp.RoutingModel(mgr)
 
-    def cb(i: int, j: int) -> int:
-        return int(dist_matrix[mgr.IndexToNode(i)][mgr.IndexToNode(j)])
-
-    idx = routing.RegisterTransitCallback(cb)
+    idx = _registrar_distancias(routing, dist_matrix)
     routing.SetArcCostEvaluatorOfAllVehicles(idx)
 
-    params = pywrapcp.DefaultRoutingSearchParameters()
-    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    params = _parametros(time_limit_s, first_solution_strategy)
     params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    params.time_limit.seconds = time_limit_s
 
-    sol = routing.SolveWithParameters(params)
+    # Parte da rota já melhorada por ``solve_tsp`` em vez da primeira solução
+    initial = solve_tsp(
+        dist_matrix, start, end, time_limit_s=1, first_solution_strategy=first_solution_strategy
+    )
+    assignment = None
+    if initial:
+        assignment = routing.ReadAssignmentFromRoutes([[mgr.NodeToIndex(i) for i in initial[1:-1]]], True)
+    if assignment:
+        sol = routing.SolveFromAssignmentWithParameters(assignment, params)
+    else:
+        sol = routing.SolveWithParameters(params)
     if not sol:
         return None
 
@@ -130,11 +276,51 @@ def solve_tsp_guided_local_search(
     return route
 
 
+def _pesos_christofides(dist_matrix: List[List[float]] | np.ndarray) -> np.ndarray:
+    """Matriz simétrica de pesos a partir do triângulo superior de ``dist_matrix``.
+
+    Distâncias nulas fora da diagonal viram o menor ``float`` positivo: tanto
+    o ``csgraph`` quanto ``nx.from_numpy_array`` tratam zero como "sem aresta"
+    e o Christofides precisa do grafo completo.
+    """
+    upper = np.triu(np.asarray(dist_matrix, dtype=np.float64), 1)
+    n = upper.shape[0]
+    mask = np.triu(np.ones((n, n), dtype=bool), 1)
+    upper[mask & (upper == 0)] = np.finfo(np.float64).tiny
+    return upper + upper.T
+
+
+def _christofides_scipy(dist_matrix: List[List[float]] | np.ndarray) -> List[int]:
+    """Christofides com a árvore geradora mínima calculada pelo SciPy.
+
+    A MST sai direto da matriz densa (triângulo superior, como o grafo da
+    NetworkX) e apenas o subgrafo dos vértices de grau ímpar, bem menor,
+    passa pelo emparelhamento perfeito de custo mínimo da NetworkX.
+    """
+    weights = _pesos_christofides(dist_matrix)
+    n = weights.shape[0]
+    if n < 3:
+        return list(range(n))
+    mst = minimum_spanning_tree(weights).tocoo()
+
+    g = nx.MultiGraph()
+    g.add_nodes_from(range(n))
+    g.add_edges_from(zip(mst.row.tolist(), mst.col.tolist()))
+    odd = [v for v, d in g.degree() if d % 2]
+    odd_graph = nx.from_numpy_array(weights[np.ix_(odd, odd)], nodelist=odd)
+    g.add_edges_from(nx.min_weight_matching(odd_graph))
+
+    walk = [u for u, _ in nx.eulerian_circuit(g, source=0)]
+    return list(dict.fromkeys(walk))
+
+
 def christofides_tsp(dist_matrix: List[List[float]], start: int, end: int) -> List[int]:
-    """Aproxima o TSP via algoritmo de Christofides da NetworkX.
+    """Aproxima o TSP via algoritmo de Christofides.
 
-    Esta função ignora ``time_limit_s`` e sempre retorna um ciclo começando em
-    ``start``. O ``end`` é reposicionado para o final da lista.
+    Esta função ignora ``time_limit_s`` e sempre retorna um caminho começando
+    em ``start``; o ``end`` é retirado do ciclo e posto no final da lista. Com SciPy
+    instalado a árvore geradora mínima é calculada sobre a matriz NumPy
+    (:func:`_christofides_scipy`); sem ele usa a implementação da NetworkX.
 
     Parameters
     ----------
@@ -151,27 +337,26 @@ def christofides_tsp(dist_matrix: List[List[float]], start: int, end: int) -> Li
         Ordem aproximada dos índices a serem visitados.
     """
 
-    n = len(dist_matrix)
-    g = nx.Graph()
-    for i in range(n):
-        for j in range(i + 1, n):
-            g.add_edge(i, j, weight=dist_matrix[i][j])
-
-    cycle = nx.approximation.christofides(g, weight="weight")
+    if minimum_spanning_tree is not None:
+        cycle = _christofides_scipy(dist_matrix)
+    else:
+        g = nx.from_numpy_array(_pesos_christofides(dist_matrix))
+        cycle = nx.approximation.christofides(g, weight="weight")
 
     if cycle and cycle[0] == cycle[-1]:
         cycle = cycle[:-1]
 
-    if start in cycle:
-        while cycle[0] != start:
-            cycle.append(cycle.pop(0))
-    if end in cycle:
-        while cycle[-1] != end:
-            cycle.append(cycle.pop(0))
-    else:
-        cycle.append(end)
-
-    return cycle
+    # ``start`` vai para a frente com uma rotação O(n) do deque; ``end`` é
+    # então movido para o fim sem tirar ``start`` da primeira posição
+    dq = deque(cycle)
+    if start in dq:
+        dq.rotate(-dq.index(start))
+    if end != start:
+        if end in dq:
+            dq.remove(end)
+        dq.append(end)
+
+    return list(dq)
 
 
 __all__.extend(["solve_tsp_guided_local_search", "christofides_tsp"])
@@ -0,0 +1,120 @@
+"""Circuit breaker e backoff para as APIs públicas (Overpass, OSRM, Open-Elevation).
+
+Quando um host acumula falhas consecutivas o circuito é aberto e novas
+chamadas falham imediatamente com :class:`CircuitOpenError`, permitindo que o
+chamador use seu valor de fallback sem esperar pelo timeout completo. Após
+``recovery_s`` segundos uma única chamada de teste é liberada (HALF_OPEN).
+"""
+
+import random
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Chamada bloqueada porque o circuito do host está aberto."""
+
+
+class CircuitBreaker:
+    """Circuit breaker CLOSED/OPEN/HALF_OPEN usado como context manager.
+
+    Parameters
+    ----------
+    name:
+        Identificação do serviço (normalmente o host).
+    failure_threshold:
+        Falhas consecutivas necessárias para abrir o circuito.
+    recovery_s:
+        Tempo em segundos até liberar uma chamada de teste.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_s: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_s = recovery_s
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Indica se uma nova chamada pode ser feita agora."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.recovery_s:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """Fecha o circuito após uma chamada bem-sucedida."""
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        """Contabiliza uma falha, abrindo o circuito se necessário."""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def __enter__(self) -> "CircuitBreaker":
+        if not self.allow():
+            raise CircuitOpenError(f"Circuito aberto para {self.name}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.record_success()
+        else:
+            self.record_failure()
+        return False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    """Retorna o circuit breaker compartilhado do host de ``url``."""
+    host = urlparse(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def reset_breakers() -> None:
+    """Descarta o estado de todos os circuit breakers."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Atraso com *full jitter* para a tentativa ``attempt`` (0, 1, 2...)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "breaker_for",
+    "reset_breakers",
+    "backoff_delay",
+]
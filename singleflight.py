@@ -0,0 +1,108 @@
+"""Coalescência de chamadas concorrentes idênticas (*single-flight*).
+
+Enquanto uma chamada para a chave ``K`` está em andamento, chamadas
+concorrentes com a mesma chave aguardam o mesmo resultado em vez de repetir a
+requisição HTTP.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Registro de chamadas em andamento compartilhado entre threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Executa ``fn`` uma única vez por ``key`` entre chamadas simultâneas."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+        if not leader:
+            return fut.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """Registro de corrotinas em andamento dentro de um loop ``asyncio``."""
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(
+        self, key: Hashable, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any
+    ) -> T:
+        """Aguarda ``fn`` uma única vez por ``key`` entre tarefas simultâneas."""
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # evita aviso de exceção não consumida
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+
+def coalesce(key_fn: Callable[..., Hashable]) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorador que aplica :class:`SingleFlight` usando ``key_fn(*args)``."""
+
+    def decorator(fn: Callable[..., T]) -> Callable[..., T]:
+        flight = SingleFlight()
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            return flight.do(key_fn(*args, **kwargs), fn, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def coalesce_async(
+    key_fn: Callable[..., Hashable]
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Decorador que aplica :class:`AsyncSingleFlight` usando ``key_fn(*args)``."""
+
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        flight = AsyncSingleFlight()
+
+        @wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            return await flight.do(key_fn(*args, **kwargs), fn, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+__all__ = ["SingleFlight", "AsyncSingleFlight", "coalesce", "coalesce_async"]
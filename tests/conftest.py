@@ -1,5 +1,36 @@
 import importlib.util
+import os
+import sys
+
+import pytest
+
+import reliability
+
+# Cache de geocoding em memória durante os testes
+os.environ.setdefault("ROTADEBARES_GEO_CACHE", ":memory:")
 
 pytest_plugins = []
 if importlib.util.find_spec("pytest_asyncio"):
     pytest_plugins.append("pytest_asyncio")
+
+
+@pytest.fixture(autouse=True)
+def _reset_circuit_breakers():
+    """Isola o estado dos circuit breakers entre os testes."""
+    reliability.reset_breakers()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def _clear_memo_caches():
+    """Descarta resultados memorizados de rede entre os testes."""
+    for module, name in (
+        ("data_fetch", "_osrm_table_cached"),
+        ("mapping", "_fetch_route_cached"),
+        ("mapping", "_build_map_cached"),
+        ("geocoding", "_geocode_cached"),
+    ):
+        cached = getattr(sys.modules.get(module), name, None)
+        if cached is not None:
+            cached.cache_clear()
+    yield
@@ -1,13 +1,27 @@
+import asyncio
+import io
+import json
+
 import pytest
 from unittest import mock
 
-pytest.importorskip("aiohttp")
+aiohttp = pytest.importorskip("aiohttp")
 import async_fetch
+import data_fetch
+
+
+class FakeStream:
+    def __init__(self, body):
+        self._buf = io.BytesIO(body)
+
+    async def read(self, n=-1):
+        return self._buf.read(n)
 
 
 class FakeResp:
     def __init__(self, data):
         self._data = data
+        self.content = FakeStream(json.dumps(data).encode())
 
     async def __aenter__(self):
         return self
@@ -21,13 +35,24 @@ class FakeResp:
     async def json(self):
         return self._data
 
+    async def read(self):
+        return json.dumps(self._data).encode()
+
+
+class FailingResp(FakeResp):
+    def __init__(self):
+        super().__init__(None)
+
+    async def __aenter__(self):
+        raise aiohttp.ClientError("fail")
+
 
 @pytest.mark.asyncio
 async def test_osrm_table_async_success():
     resp = FakeResp({"distances": [[0, 1], [1, 0]]})
 
     class FakeSession:
-        async def get(self, *args, **kwargs):
+        def get(self, *args, **kwargs):
             return resp
 
     with mock.patch("async_fetch.get_session", return_value=FakeSession()):
@@ -37,16 +62,115 @@ async def test_osrm_table_async_success():
 
 @pytest.mark.asyncio
 async def test_osrm_table_async_fallback():
-    async def fake_get(url, params=None, timeout=None):
-        if params and "sources" in params:
-            idx = params["sources"]
-            return FakeResp({"distances": [[idx * 10, idx * 10 + 1]]})
-        raise aiohttp.ClientError("fail")
-
     class FakeSession:
-        async def get(self, url, params=None, timeout=None):
-            return await fake_get(url, params=params, timeout=timeout)
+        def get(self, url, params=None, timeout=None):
+            if params and "sources" in params:
+                idx = params["sources"]
+                return FakeResp({"distances": [[idx * 10, idx * 10 + 1]]})
+            return FailingResp()
 
     with mock.patch("async_fetch.get_session", return_value=FakeSession()):
         result = await async_fetch.osrm_table_async([(0, 0), (1, 1)])
         assert result == [[0, 1], [10, 11]]
+
+
+@pytest.mark.asyncio
+async def test_osrm_table_async_chunked_fallback():
+    n = async_fetch.OSRM_CHUNK + 4
+    calls = []
+
+    class FakeSession:
+        def get(self, url, params=None, timeout=None):
+            calls.append(params)
+            if params and "sources" in params:
+                ids = [int(i) for i in str(params["sources"]).split(";")]
+                return FakeResp({"distances": [[i] * n for i in ids]})
+            return FailingResp()
+
+    with mock.patch("async_fetch.get_session", return_value=FakeSession()):
+        result = await async_fetch.osrm_table_async([(i, i) for i in range(n)])
+    assert result == [[i] * n for i in range(n)]
+    # Uma requisição completa que falha + dois blocos
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_coletar_pois_async_filters_stream():
+    elements = [
+        {"tags": {"name": "Bar1"}, "lat": 1, "lon": 1},
+        {"tags": {"name": "bar1"}, "lat": 1.000001, "lon": 1},
+        {"tags": {"name": "Bar2"}, "center": {"lat": 1.5, "lon": 1.5}},
+        {"tags": {"name": "Bar3"}, "lat": 5, "lon": 5},
+        {"tags": {"name": "Bar4", "addr:city": "Outra"}, "lat": 1, "lon": 1},
+        {"tags": {}, "lat": 1, "lon": 1},
+    ]
+    resp = FakeResp({"elements": elements})
+
+    class FakeSession:
+        def post(self, *args, **kwargs):
+            return resp
+
+    with mock.patch("async_fetch.get_session", return_value=FakeSession()), \
+         mock.patch("async_fetch.get_city_bbox", return_value=(0, 2, 0, 2)), \
+         mock.patch("async_fetch.get_city_area_id", return_value=None), \
+         mock.patch("async_fetch.get_city_polygon", return_value=None):
+        pois = await async_fetch.coletar_pois_async("cidade")
+    assert pois == [
+        {"name": "Bar1", "lat": 1.0, "lon": 1.0},
+        {"name": "Bar2", "lat": 1.5, "lon": 1.5},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_altitude_async_micro_batches():
+    posts = []
+
+    class FakeSession:
+        def post(self, url, json=None, timeout=None):
+            posts.append(json["locations"])
+            return FakeResp({"results": [{"elevation": loc["latitude"] * 10} for loc in json["locations"]]})
+
+    with mock.patch("async_fetch.get_session", return_value=FakeSession()):
+        a, b, c = await asyncio.gather(
+            async_fetch.batch_altitude_async([(1, 0)]),
+            async_fetch.batch_altitude_async([(2, 0), (3, 0)]),
+            async_fetch.batch_altitude_async([(4, 0)]),
+        )
+    assert (a, b, c) == ([10], [20, 30], [40])
+    assert len(posts) == 1
+
+
+@pytest.mark.asyncio
+async def test_coletar_pois_sync_async_match():
+    elements = [
+        {"tags": {"name": "Bar1"}, "lat": 1, "lon": 1},
+        {"tags": {"name": "BAR1"}, "lat": 1.2, "lon": 1.2},
+        {"tags": {"name": "Bar2"}, "center": {"lat": 1.5, "lon": 1.5}},
+        {"tags": {"name": "Bar3"}, "lat": 5, "lon": 5},
+    ]
+
+    class FakeSession:
+        def post(self, *args, **kwargs):
+            return FakeResp({"elements": elements})
+
+    class FakeSyncResp:
+        content = json.dumps({"elements": elements}).encode()
+
+        def raise_for_status(self):
+            pass
+
+    patches = {
+        "get_city_bbox": mock.Mock(return_value=(0, 2, 0, 2)),
+        "get_city_area_id": mock.Mock(return_value=None),
+        "get_city_polygon": mock.Mock(return_value=None),
+    }
+    with mock.patch("async_fetch.get_session", return_value=FakeSession()), \
+         mock.patch("data_fetch.session.post", return_value=FakeSyncResp()), \
+         mock.patch.multiple("async_fetch", **patches), \
+         mock.patch.multiple("data_fetch", **patches):
+        pois_async = await async_fetch.coletar_pois_async("cidade")
+        pois_sync = data_fetch.coletar_pois("cidade")
+    assert pois_async == pois_sync == [
+        {"name": "Bar1", "lat": 1.0, "lon": 1.0},
+        {"name": "Bar2", "lat": 1.5, "lon": 1.5},
+    ]
@@ -1,3 +1,4 @@
+import json
 from unittest import mock
 import pytest
 
@@ -7,6 +8,7 @@ data_fetch = pytest.importorskip("data_fetch")
 class FakeResp:
     def __init__(self, data):
         self._data = data
+        self.content = json.dumps(data).encode()
     def raise_for_status(self):
         pass
     def json(self):
@@ -38,6 +40,8 @@ def test_coletar_pois_bbox_filtering():
     resp = FakeResp({"elements": elements})
     bbox = (0, 2, 0, 2)
     with mock.patch("data_fetch.get_city_bbox", return_value=bbox), \
+         mock.patch("data_fetch.get_city_area_id", return_value=None), \
+         mock.patch("data_fetch.get_city_polygon", return_value=None), \
          mock.patch("data_fetch.session.post", return_value=resp):
         pois = data_fetch.coletar_pois("cidade")
         assert pois == [{"name": "Bar1", "lat": 1.0, "lon": 1.0}]
@@ -51,6 +55,8 @@ def test_coletar_pois_dedup_inside():
     resp = FakeResp({"elements": elements})
     bbox = (0, 2, 0, 2)
     with mock.patch("data_fetch.get_city_bbox", return_value=bbox), \
+         mock.patch("data_fetch.get_city_area_id", return_value=None), \
+         mock.patch("data_fetch.get_city_polygon", return_value=None), \
          mock.patch("data_fetch.session.post", return_value=resp):
         pois = data_fetch.coletar_pois("cidade")
         assert pois == [{"name": "Bar1", "lat": 1.0, "lon": 1.0}]
@@ -89,3 +95,82 @@ def test_coletar_pois_polygon():
          mock.patch("data_fetch.session.post", return_value=resp):
         pois = data_fetch.coletar_pois("cidade")
         assert pois == [{"name": "Bar1", "lat": 1.0, "lon": 1.0}]
+
+
+def test_osrm_coords_format():
+    assert data_fetch.osrm_coords([(-18.2412345678, -43.6), (1, 2)]) == "-43.600000,-18.241235;2.000000,1.000000"
+
+
+def test_osrm_table_chunked_fallback():
+    n = data_fetch.OSRM_CHUNK + 4
+    calls = []
+
+    def side_effect(url, params=None, timeout=None):
+        calls.append(params)
+        if 'sources' in params:
+            ids = [int(i) for i in str(params['sources']).split(';')]
+            return FakeResp({"distances": [[i] * n for i in ids]})
+        raise requests.RequestException('fail')
+
+    with mock.patch('data_fetch.session.get', side_effect=side_effect):
+        result = data_fetch.osrm_table([(i, i) for i in range(n)])
+    assert result == [[i] * n for i in range(n)]
+    assert len(calls) == 3
+
+
+def test_decode_distances_and_elevations():
+    assert data_fetch.decode_distances(b'{"code": "Ok", "distances": [[0, 1.5], [null, 0]]}') == [[0, 1.5], [None, 0]]
+    assert data_fetch.decode_elevations(b'{"results": [{"latitude": 1, "elevation": 700}]}') == [700]
+
+
+
+def test_decode_polyline_google_example():
+    # Exemplo da documentação do algoritmo (precisão 5)
+    coords = data_fetch.decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@", precision=5)
+    assert coords == [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+
+def test_osrm_table_sources_destinations():
+    resp = FakeResp({"distances": [[5], [7]]})
+    with mock.patch("data_fetch.session.get", return_value=resp) as mg:
+        result = data_fetch.osrm_table([(0, 0), (1, 1), (2, 2)], sources=[0, 1], destinations=[2])
+    assert result == [[5], [7]]
+    params = mg.call_args.kwargs["params"]
+    assert (params["sources"], params["destinations"]) == ("0;1", "2")
+
+
+def test_osrm_table_memoized_not_failures():
+    resp = FakeResp({"distances": [[0, 1], [1, 0]]})
+    with mock.patch("data_fetch.session.get", side_effect=data_fetch.requests.ConnectionError("x")):
+        assert data_fetch.osrm_table([(0, 0), (1, 1)]) == [[0, 0], [0, 0]]
+    with mock.patch("data_fetch.session.get", return_value=resp) as mg:
+        first = data_fetch.osrm_table([(0, 0), (1, 1)])
+        first[0][1] = 99  # cópia: não altera o cache
+        assert data_fetch.osrm_table([(0.0000001, 0), (1, 1)]) == [[0, 1], [1, 0]]
+    assert mg.call_count == 1
+
+
+def test_osrm_table_symmetric_upper_triangle():
+    n = 5
+    cells = []
+
+    def fake_get(url, params=None, timeout=None):
+        src = [int(i) for i in params["sources"].split(";")]
+        dst = [int(j) for j in params["destinations"].split(";")]
+        cells.append(len(src) * len(dst))
+        return FakeResp({"distances": [[i * 10 + j if j >= i else -1 for j in dst] for i in src]})
+
+    with mock.patch("data_fetch.session.get", side_effect=fake_get):
+        result = data_fetch.osrm_table([(i, i) for i in range(n)], symmetric=True)
+    assert result == [[min(i, j) * 10 + max(i, j) for j in range(n)] for i in range(n)]
+    assert sum(cells) < n * n
+
+
+@pytest.mark.parametrize("use_msgspec", [True, False])
+def test_decode_elevations_null_as_zero(monkeypatch, use_msgspec):
+    if use_msgspec and data_fetch.msgspec is None:
+        pytest.skip("msgspec ausente")
+    if not use_msgspec:
+        monkeypatch.setattr(data_fetch, "msgspec", None)
+    body = b'{"results": [{"elevation": 1}, {"elevation": null}, {}]}'
+    assert data_fetch.decode_elevations(body) == [1, 0.0, 0.0]
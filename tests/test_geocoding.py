@@ -22,7 +22,8 @@ def test_dentro_da_cidade_false():
 def test_geocode_strict_cache():
     fake = FakeLoc(1.0, 2.0)
     with mock.patch('geocoding.geocode_rl', return_value=fake) as mg:
-        with mock.patch('geocoding.get_city_bbox', return_value=(-2,2,-2,2)):
+        with mock.patch('geocoding.get_city_bbox', return_value=(-2,2,-2,2)), \
+             mock.patch('geocoding.get_city_polygon', return_value=None):
             geocoding._cache_geo.clear()
             r1 = geocoding.geocode_strict_single('addr', 'city')
             r2 = geocoding.geocode_strict_single('addr', 'city')
@@ -32,11 +33,13 @@ def test_geocode_strict_cache():
 
 def test_geocode_fallback_photon():
     fake = FakeLoc(3.0, 4.0)
-    with mock.patch('geocoding.geocode_rl', return_value=None):
-        with mock.patch('geocoding.photon_geocode_rl', return_value=fake):
-            geocoding._cache_geo.clear()
-            result = geocoding.geocode_fallback_single('addr', 'city')
-            assert result == (3.0, 4.0)
+    with mock.patch('geocoding.geocode_rl', return_value=None), \
+         mock.patch('geocoding.photon_geocode_rl', return_value=fake), \
+         mock.patch('geocoding.get_city_bbox', return_value=None), \
+         mock.patch('geocoding.get_city_polygon', return_value=None):
+        geocoding._cache_geo.clear()
+        result = geocoding.geocode_fallback_single('addr', 'city')
+        assert result == (3.0, 4.0)
 
 
 def test_geocode_city_mismatch():
@@ -62,3 +65,143 @@ def test_geocode_polygon_filter():
             with mock.patch('geocoding.get_city_polygon', return_value=DummyPoly()):
                 geocoding._cache_geo.clear()
                 assert geocoding.geocode_strict_single('addr', 'city') is None
+
+
+def test_geo_cache_persists(tmp_path):
+    path = str(tmp_path / "geo.sqlite")
+    cache = geocoding._GeoCache(path)
+    cache.set("strict|addr|city", (1.0, 2.0))
+    cache.set("bbox|city", None)
+    reopened = geocoding._GeoCache(path)
+    assert reopened.get("strict|addr|city") == (1.0, 2.0)
+    assert "bbox|city" in reopened
+    assert reopened.get("bbox|city", "miss") is None
+
+
+def test_geo_cache_ttl(tmp_path):
+    cache = geocoding._GeoCache(str(tmp_path / "geo.sqlite"), ttl=-1)
+    cache.set("strict|addr|city", (1.0, 2.0))
+    assert "strict|addr|city" not in cache
+
+
+def test_geocode_strict_negative_cache():
+    with mock.patch('geocoding.geocode_rl', return_value=None) as mg:
+        with mock.patch('geocoding.get_city_bbox', return_value=None), \
+             mock.patch('geocoding.get_city_polygon', return_value=None):
+            geocoding._cache_geo.clear()
+            assert geocoding.geocode_strict_single('addr', 'city') is None
+            assert geocoding.geocode_strict_single('addr', 'city') is None
+            assert mg.call_count == 1
+
+
+def test_points_in_polygon_vectorized():
+    shapely_geometry = pytest.importorskip("shapely.geometry")
+    poly = shapely_geometry.Polygon([(0, 0), (2, 0), (2, 2), (0, 2)])
+    mask = geocoding.points_in_polygon([1, 5, 1.5], [1, 5, 0.5], poly)
+    assert mask.tolist() == [True, False, True]
+
+
+def test_mascara_cidade_bbox():
+    mask = geocoding.mascara_cidade([1, 5, 1], [1, 1, 3], (0, 2, 0, 2), None)
+    assert mask.tolist() == [True, False, False]
+
+
+def test_get_city_polygon_prepared():
+    shapely = pytest.importorskip("shapely")
+    if not hasattr(shapely, "is_prepared"):
+        pytest.skip("Shapely < 2")
+    poly = shapely.geometry.Polygon([(0, 0), (2, 0), (2, 2), (0, 2)])
+    geocoding._cache_geo.clear()
+    geocoding._cache_geo.set("poly|Cidade", poly)
+    geocoding.get_city_polygon.cache_clear()
+    result = geocoding.get_city_polygon("Cidade")
+    geocoding.get_city_polygon.cache_clear()
+    assert shapely.is_prepared(result)
+    assert geocoding.point_in_polygon(1, 1, result)
+    assert not geocoding.point_in_polygon(3, 1, result)
+
+
+def test_normalizar_nome():
+    assert geocoding.normalizar_nome("São João del-Rei") == geocoding.normalizar_nome("SAO JOAO DEL-REI")
+
+
+def test_geocode_city_accent_match():
+    loc = FakeLoc(1.0, 2.0)
+    loc.raw = {"address": {"city": "Itajubá"}}
+    with mock.patch('geocoding.geocode_rl', return_value=loc), \
+         mock.patch('geocoding.get_city_bbox', return_value=(-2, 2, -2, 2)), \
+         mock.patch('geocoding.get_city_polygon', return_value=None):
+        geocoding._cache_geo.clear()
+        assert geocoding.geocode_strict_single('addr', 'Itajuba') == (1.0, 2.0)
+
+
+def test_dentro_da_cidade_arrays():
+    import numpy as np
+
+    bbox = (-10, 10, -20, 20)
+    mask = geocoding.dentro_da_cidade(np.array([0, 15, -5]), np.array([0, 0, 25]), bbox)
+    assert mask.tolist() == [True, False, False]
+
+
+def test_geocode_strict_cache_normalized_key():
+    fake = FakeLoc(1.0, 2.0)
+    with mock.patch('geocoding.geocode_rl', return_value=fake) as mg, \
+         mock.patch('geocoding.get_city_bbox', return_value=(-2, 2, -2, 2)), \
+         mock.patch('geocoding.get_city_polygon', return_value=None):
+        geocoding._cache_geo.clear()
+        assert geocoding.geocode_strict_single('Rua  X ', 'City') == (1.0, 2.0)
+        assert geocoding.geocode_strict_single('rua x', 'city') == (1.0, 2.0)
+        assert mg.call_count == 1
+
+
+def test_geo_cache_items_prefix(tmp_path):
+    cache = geocoding._GeoCache(str(tmp_path / "geo.sqlite"))
+    cache.set("strict|rua x|city", (1.0, 2.0))
+    cache.set("fallback|rua y|city", (3.0, 4.0))
+    assert cache.items("strict|") == [("strict|rua x|city", (1.0, 2.0))]
+
+
+def test_geocode_fallback_fuzzy_reuses_strict():
+    pytest.importorskip("rapidfuzz")
+    geocoding._cache_geo.clear()
+    geocoding._cache_geo.set("strict|rua joao pessoa 100|city", (1.0, 2.0))
+    with mock.patch('geocoding.geocode_rl', return_value=None), \
+         mock.patch('geocoding.photon_geocode_rl') as mp, \
+         mock.patch('geocoding.get_city_bbox', return_value=None), \
+         mock.patch('geocoding.get_city_polygon', return_value=None):
+        assert geocoding.geocode_fallback_single('Rua Joao Pesoa 100', 'city') == (1.0, 2.0)
+        mp.assert_not_called()
+
+
+def test_geocode_batch_order_and_dedup():
+    geocoding._geocode_cached.cache_clear()
+    found = {"a": (1.0, 1.0), "b": (2.0, 2.0)}
+    with mock.patch('geocoding.geocode_strict_single', side_effect=lambda q, c: found.get(q)) as ms, \
+         mock.patch('geocoding.geocode_fallback_single', return_value=None), \
+         mock.patch('geocoding.get_city_bbox', return_value=None), \
+         mock.patch('geocoding.get_city_polygon', return_value=None):
+        result = geocoding.geocode_batch(["b", "x", "a", "b"], "city")
+    assert result == [(2.0, 2.0), None, (1.0, 1.0), (2.0, 2.0)]
+    assert ms.call_count == 3
+
+
+def test_geocode_fallback_fuzzy_requires_same_numbers():
+    pytest.importorskip("rapidfuzz")
+    geocoding._cache_geo.clear()
+    geocoding._cache_geo.set("strict|rua x 180|city", (1.0, 2.0))
+    with mock.patch('geocoding.geocode_rl', return_value=None), \
+         mock.patch('geocoding.photon_geocode_rl', return_value=None), \
+         mock.patch('geocoding.get_city_bbox', return_value=None), \
+         mock.patch('geocoding.get_city_polygon', return_value=None):
+        assert geocoding._buscar_similar('Rua X 100', 'city') is None
+        assert geocoding.geocode_fallback_single('Rua X 100', 'city') is None
+
+
+def test_geocode_batch_resolves_city_once_before_workers():
+    calls = []
+    with mock.patch('geocoding.get_city_bbox', side_effect=lambda c: calls.append("bbox")), \
+         mock.patch('geocoding.get_city_polygon', side_effect=lambda c: calls.append("poly")), \
+         mock.patch('geocoding.geocode_single', side_effect=lambda q, c: calls.append(q)):
+        geocoding.geocode_batch(["a", "b"], "city")
+    assert calls[:2] == ["bbox", "poly"]
+    assert sorted(calls[2:]) == ["a", "b"]
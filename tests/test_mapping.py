@@ -0,0 +1,52 @@
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("folium")
+import mapping
+
+
+class FakeResp:
+    content = b'{"routes": [{"geometry": "_p~iF~ps|U"}]}'
+
+    def raise_for_status(self):
+        pass
+
+
+def test_fetch_route_geometry_multi_memoized():
+    mapping._fetch_route_cached.cache_clear()
+    with mock.patch("mapping.session.get", return_value=FakeResp()) as mg:
+        a = mapping.fetch_route_geometry_multi([(1.0, 2.0), (3.0, 4.0)])
+        b = mapping.fetch_route_geometry_multi([(1.0, 2.0), (3.0, 4.0)])
+    assert a == b and len(a) == 1
+    assert mg.call_count == 1
+
+
+def test_fetch_route_geometry_multi_failure_not_cached():
+    mapping._fetch_route_cached.cache_clear()
+    with mock.patch("mapping.session.get", side_effect=mapping.requests.ConnectionError("down")):
+        assert mapping.fetch_route_geometry_multi([(1.0, 2.0), (3.0, 4.0)]) == []
+    with mock.patch("mapping.session.get", return_value=FakeResp()):
+        assert mapping.fetch_route_geometry_multi([(1.0, 2.0), (3.0, 4.0)]) != []
+
+
+def test_build_map_memoized_and_save_skips_unchanged(tmp_path):
+    coords = [(0.0, 0.0, 0.0), (0.001, 0.001, 0.0), (0.002, 0.0, 0.0)]
+    names = ["Partida", "Bar", "Destino"]
+    with mock.patch("mapping.session.get", return_value=FakeResp()) as mg:
+        m = mapping.build_map([0, 1, 2], coords, names)
+        assert mapping.build_map([0, 1, 2], coords, names) is m
+    assert mg.call_count == 1
+    out = tmp_path / "rota.html"
+    assert mapping.save_map(m, str(out))
+    assert not mapping.save_map(m, str(out))
+    out.unlink()
+    assert mapping.save_map(m, str(out))
+
+
+def test_build_map_without_route_not_cached():
+    coords = [(0.0, 0.0, 0.0), (0.001, 0.001, 0.0)]
+    with mock.patch("mapping.session.get", side_effect=mapping.requests.ConnectionError("down")):
+        m = mapping.build_map([0, 1], coords, ["Partida", "Destino"])
+    assert mapping._build_map_cached.cache_info().currsize == 0
+    assert isinstance(m, mapping.folium.Map)
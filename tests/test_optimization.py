@@ -65,3 +65,80 @@ def test_apply_elevation_penalty_changes_best():
     penal = opt.apply_elevation_penalty(base, coords, weight=1)
     penal_best = min(range(1, 3), key=lambda i: penal[i][3])
     assert plain_best != penal_best
+
+
+def test_apply_elevation_penalty_values():
+    coords = [(0, 0, 10), (0, 0, 0), (0, 0, 30)]
+    base = [[0, 5, 5], [5, 0, 5], [5, 5, 0]]
+    penal = opt.apply_elevation_penalty(base, coords, weight=2)
+    assert penal.tolist() == [[0, 5, 45], [25, 0, 65], [5, 5, 0]]
+
+
+@pytest.mark.skipif(not ORTOOLS_AVAILABLE, reason="ortools ausente")
+def test_solve_tsp_ndarray_matrix():
+    import numpy as np
+
+    r = opt.solve_tsp(np.asarray(DIST, dtype=float) + 0.5, 0, 3)
+    _check_route(r)
+
+
+@pytest.mark.skipif(not ORTOOLS_AVAILABLE, reason="ortools ausente")
+def test_int_matrix_cached_across_solves():
+    opt._int_rows.cache_clear()
+    opt.solve_tsp(DIST, 0, 3)
+    opt.solve_tsp(DIST, 0, 3)
+    info = opt._int_rows.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+
+def test_christofides_scipy_visits_all():
+    pytest.importorskip("scipy")
+    r = opt._christofides_scipy(DIST)
+    assert sorted(r) == [0, 1, 2, 3]
+
+
+@pytest.mark.skipif(not ORTOOLS_AVAILABLE, reason="ortools ausente")
+def test_solve_tsp_first_solution_strategy():
+    from ortools.constraint_solver import routing_enums_pb2
+
+    strategy = routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+    _check_route(opt.solve_tsp(DIST, 0, 3, first_solution_strategy=strategy))
+
+
+def test_int_matrix_scaled_rounding():
+    mat = opt._int_matrix([[0, 1.2346], [0.4, 0]])
+    assert mat.tolist() == [[0, 1235], [400, 0]]
+
+
+def test_apply_elevation_penalty_keeps_input():
+    import numpy as np
+
+    base = np.zeros((2, 2))
+    penal = opt.apply_elevation_penalty(base, [(0, 0, 0), (0, 0, 10)], weight=1)
+    assert penal[0, 1] == 10
+    assert not base.any()
+
+
+def test_apply_elevation_penalty_in_place():
+    import numpy as np
+
+    base = np.zeros((2, 2))
+    penal = opt.apply_elevation_penalty(base, [(0, 0, 0), (0, 0, 10)], weight=1, copy=False)
+    assert penal is base
+    assert base[0, 1] == 10
+
+
+def test_int_matrix_unreachable_pairs():
+    mat = opt._int_matrix([[0, None], [1.0, float("nan")]])
+    big = int(opt.UNREACHABLE * opt.SCALE)
+    assert mat.tolist() == [[0, big], [1000, big]]
+
+
+@pytest.mark.parametrize("start,end", [(0, 3), (0, 1), (2, 0), (1, 2)])
+def test_christofides_tsp_scipy_aligns_start_end(start, end):
+    pytest.importorskip("scipy")
+    assert opt.minimum_spanning_tree is not None
+    r = opt.christofides_tsp(DIST, start, end)
+    assert r[0] == start
+    assert r[-1] == end
+    assert sorted(set(r)) == [0, 1, 2, 3]
@@ -0,0 +1,53 @@
+from unittest import mock
+
+import pytest
+
+import reliability
+from reliability import CircuitBreaker, CircuitOpenError
+
+
+def _fail(breaker):
+    with pytest.raises(ValueError):
+        with breaker:
+            raise ValueError("down")
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("host", failure_threshold=2, recovery_s=60)
+    _fail(breaker)
+    assert breaker.state == reliability.CLOSED
+    _fail(breaker)
+    assert breaker.state == reliability.OPEN
+    with pytest.raises(CircuitOpenError):
+        with breaker:
+            pass
+
+
+def test_breaker_half_open_probe():
+    breaker = CircuitBreaker("host", failure_threshold=1, recovery_s=0)
+    _fail(breaker)
+    assert breaker.allow()  # chamada de teste liberada
+    assert not breaker.allow()  # apenas uma por vez
+    breaker.record_success()
+    assert breaker.state == reliability.CLOSED
+
+
+def test_breaker_for_shares_host():
+    a = reliability.breaker_for("http://router.project-osrm.org/table/v1/foot/1,2")
+    b = reliability.breaker_for("http://router.project-osrm.org/route/v1/foot/3,4")
+    assert a is b
+
+
+def test_osrm_table_open_circuit_skips_http():
+    data_fetch = pytest.importorskip("data_fetch")
+    breaker = reliability.breaker_for("http://router.project-osrm.org/")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    with mock.patch("data_fetch.session.get") as mg:
+        assert data_fetch.osrm_table([(0, 0), (1, 1)]) == [[0, 0], [0, 0]]
+        mg.assert_not_called()
+
+
+def test_backoff_delay_bounds():
+    for attempt in range(6):
+        assert 0 <= reliability.backoff_delay(attempt, base=1, cap=8) <= 8
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, coalesce, coalesce_async
+
+
+def test_singleflight_coalesces_threads():
+    calls = []
+    started = threading.Event()
+
+    @coalesce(lambda key: key)
+    def slow(key):
+        calls.append(key)
+        started.set()
+        time.sleep(0.1)
+        return key * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow(21))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [42] * 5
+    assert calls == [21]
+
+
+def test_singleflight_propagates_exception():
+    flight = SingleFlight()
+
+    def boom():
+        raise ValueError("x")
+
+    with pytest.raises(ValueError):
+        flight.do("k", boom)
+    assert flight.do("k", lambda: 1) == 1
+
+
+@pytest.mark.asyncio
+async def test_coalesce_async():
+    calls = []
+
+    @coalesce_async(lambda key: key)
+    async def slow(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return key + 1
+
+    results = await asyncio.gather(*(slow(1) for _ in range(4)), slow(2))
+    assert results == [2, 2, 2, 2, 3]
+    assert calls == [1, 2]
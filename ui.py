@@ -1,61 +1,130 @@
+import asyncio
 import logging
+import queue
+import threading
+import time
+import traceback
+from functools import lru_cache
+from logging.handlers import QueueHandler
 
 import ipywidgets as widgets
+import numpy as np
 from IPython.display import display, clear_output, FileLink
 
-from geocoding import geocode_strict_single, geocode_fallback_single
-from data_fetch import coletar_pois, batch_altitude, osrm_table
-from optimization import solve_tsp, apply_elevation_penalty
-from mapping import build_map
+from async_fetch import batch_altitude_async
+from geocoding import geocode_batch
+from data_fetch import coletar_pois, osrm_table
+from optimization import solve_tsp, apply_elevation_penalty, finite_distances
+from mapping import build_map, save_map
 
 log = logging.getLogger(__name__)
 
+# Widgets criados sob demanda por ``_build_widgets`` (na primeira chamada de
+# ``launch_ui``); importar o módulo não cria widgets nem comms do kernel
+city_widget = load_pois_btn = pois_select = custom_txt = None
+start_txt = end_txt = same_cb = elev_weight = compute_btn = None
+out = None
+pois_data = []  # (nome, lat, lon) de cada opção de ``pois_select``, pelo índice
+
+# Logs de qualquer thread vão para uma fila; uma única thread os escreve no
+# widget em lotes, evitando uma mensagem de comm por linha de log
+LOG_BATCH = 50
+LOG_WINDOW_S = 0.05
+if "log_queue" not in globals():  # preservada em ``importlib.reload``
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+
+
+def _drain_logs() -> None:
+    """Consome a fila de logs e escreve as mensagens no widget ``out``.
+
+    Erros ao escrever um lote são reportados em ``stderr`` e o lote é
+    descartado; a thread continua, senão a fila cresceria sem ninguém lê-la.
+    """
+
+    while True:
+        batch = [log_queue.get()]
+        deadline = time.monotonic() + LOG_WINDOW_S
+        while len(batch) < LOG_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(log_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            out.append_stdout("".join(f"{r.getMessage()}\n" for r in batch))
+        except Exception:
+            traceback.print_exc()
+
+
+def _build_widgets() -> None:
+    """Cria os widgets e liga os logs a ``out``; chamadas seguintes não fazem nada."""
+
+    global city_widget, load_pois_btn, pois_select, custom_txt
+    global start_txt, end_txt, same_cb, elev_weight, compute_btn, out
+    if out is not None:
+        return
 
-class WidgetHandler(logging.Handler):
-    """Handler que redireciona logs para um ``ipywidgets.Output``."""
-
-    def __init__(self, widget: widgets.Output) -> None:
-        """Inicializa o handler.
-
-        Parameters
-        ----------
-        widget:
-            Widget que exibirá as mensagens de log.
-        """
-
-        super().__init__()
-        self.widget = widget
-
-    def emit(self, record: logging.LogRecord) -> None:
-        """Imprime a mensagem formatada dentro do widget."""
-
-        msg = self.format(record)
-        with self.widget:
-            print(msg)
-
+    city_widget = widgets.Text(value="Diamantina", description="Município:")
+    load_pois_btn = widgets.Button(description="Buscar Locais", button_style="info")
+    pois_select = widgets.SelectMultiple(options=[], layout=widgets.Layout(height='300px', width='auto'))
+    custom_txt = widgets.Textarea(placeholder="Extras (uma linha cada)", description="Extras:")
+    start_txt = widgets.Text(placeholder="Ex.: Rua das Mercês, 310", description="Partida:")
+    end_txt = widgets.Text(placeholder="Ex.: Rua Barão…, 208", description="Destino:")
+    same_cb = widgets.Checkbox(description="Partida = Destino")
+    elev_weight = widgets.FloatSlider(
+        value=0.0,
+        min=0.0,
+        max=5.0,
+        step=0.1,
+        description="Peso subida:",
+    )
+    compute_btn = widgets.Button(description="Gerar HTML", button_style="success")
+    out = widgets.Output()
 
-city_widget = widgets.Text(value="Diamantina", description="Município:")
-load_pois_btn = widgets.Button(description="Buscar Locais", button_style="info")
-pois_box = widgets.VBox([], layout=widgets.Layout(overflow='auto', height='300px', border='1px solid #ccc'))
-custom_txt = widgets.Textarea(placeholder="Extras (uma linha cada)", description="Extras:")
-start_txt = widgets.Text(placeholder="Ex.: Rua das Mercês, 310", description="Partida:")
-end_txt = widgets.Text(placeholder="Ex.: Rua Barão…, 208", description="Destino:")
-same_cb = widgets.Checkbox(description="Partida = Destino")
-elev_weight = widgets.FloatSlider(
-    value=0.0,
-    min=0.0,
-    max=5.0,
-    step=0.1,
-    description="Peso subida:",
-)
-compute_btn = widgets.Button(description="Gerar HTML", button_style="success")
-out = widgets.Output()
-pois_checkboxes = []
+    load_pois_btn.on_click(on_load_pois)
+    same_cb.observe(on_same_change, "value")
+    compute_btn.on_click(on_compute)
 
-widget_handler = WidgetHandler(out)
-widget_handler.setFormatter(logging.Formatter("%(message)s"))
-log.addHandler(widget_handler)
-log.propagate = False
+    # O logger, a fila e a thread de drenagem sobrevivem a ``importlib.reload``:
+    # troca o handler da carga anterior em vez de acumular handlers e mantém
+    # uma única thread, que escreve sempre no ``out`` atual
+    for handler in [h for h in log.handlers if isinstance(h, QueueHandler)]:
+        log.removeHandler(handler)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(queue_handler)
+    log.propagate = False
+    if not any(t.name == "ui-log-drain" for t in threading.enumerate()):
+        threading.Thread(target=_drain_logs, name="ui-log-drain", daemon=True).start()
+
+
+@lru_cache(maxsize=None)
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """Loop de eventos da UI, rodando em uma thread daemon própria.
+
+    O kernel do Jupyter já mantém um loop ativo na thread principal, o que
+    impede ``asyncio.run`` dentro dos callbacks; um loop persistente também
+    preserva a sessão ``aiohttp`` (e suas conexões) entre cálculos.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="ui-async", daemon=True).start()
+    return loop
+
+
+async def _altitudes_e_distancias(latlons: list, altitudes: bool = True, **osrm_kwargs) -> tuple:
+    """Busca altitudes e matriz OSRM ao mesmo tempo no loop da UI.
+
+    Com ``altitudes=False`` o Open-Elevation não é consultado e as altitudes
+    voltam zeradas.
+    """
+    if not altitudes:
+        return [0.0] * len(latlons), await asyncio.to_thread(osrm_table, latlons, **osrm_kwargs)
+    return await asyncio.gather(
+        batch_altitude_async(latlons),
+        asyncio.to_thread(osrm_table, latlons, **osrm_kwargs),
+    )
 
 
 def on_load_pois(_: widgets.Button) -> None:
@@ -65,14 +134,11 @@ def on_load_pois(_: widgets.Button) -> None:
         clear_output()
     log.info(f"🔍 Buscando POIs em {city_widget.value}…")
     pois = coletar_pois(city_widget.value.strip())
-    pois_checkboxes.clear()
-    items = []
-    for p in pois:
-        desc = f"{p['name']} ({p['lat']:.5f},{p['lon']:.5f})"
-        cb = widgets.Checkbox(False, description=desc)
-        pois_checkboxes.append(cb)
-        items.append(cb)
-    pois_box.children = items
+    pois_data[:] = [(p['name'], p['lat'], p['lon']) for p in pois]
+    pois_select.value = ()
+    pois_select.options = [
+        (f"{nm} ({lat:.5f},{lon:.5f})", i) for i, (nm, lat, lon) in enumerate(pois_data)
+    ]
     log.info(f"✅ {len(pois)} POIs carregados.")
 
 
@@ -94,76 +160,98 @@ def on_compute(_: widgets.Button) -> None:
     start = start_txt.value.strip()
     end = start if same_cb.value else end_txt.value.strip()
 
-    log.info("⏳ Geocodificando partida e destino…")
-    pt0 = geocode_strict_single(start, city) or geocode_fallback_single(start, city)
+    # Linhas repetidas são geocodificadas (e visitadas) uma única vez
+    extras = list(dict.fromkeys(l.strip() for l in custom_txt.value.splitlines() if l.strip()))
+
+    log.info("⏳ Geocodificando partida, destino e extras…")
+    ends = [start] if same_cb.value else [start, end]
+    geos = geocode_batch(ends + extras, city)
+    pt0 = geos[0]
+    pt1 = geos[len(ends) - 1]
     if not pt0:
         log.error(f"❌ Falha geocode partida: {start}")
         return
-    pt1 = pt0 if same_cb.value else (geocode_strict_single(end, city) or geocode_fallback_single(end, city))
     if not pt1:
         log.error(f"❌ Falha geocode destino: {end}")
         return
 
-    coords = [(pt0[0], pt0[1])]
+    latlons = [pt0]
     names = ["Partida"]
-    for cb in pois_checkboxes:
-        if cb.value:
-            nm, coord = cb.description.split(' (')
-            lat, lon = coord[:-1].split(',')
-            coords.append((float(lat), float(lon)))
-            names.append(nm)
-    extras = [l.strip() for l in custom_txt.value.splitlines() if l.strip()]
-    for ex in extras:
-        geo = geocode_strict_single(ex, city) or geocode_fallback_single(ex, city)
+    for i in pois_select.value:
+        nm, lat, lon = pois_data[i]
+        latlons.append((lat, lon))
+        names.append(nm)
+    for ex, geo in zip(extras, geos[len(ends):]):
         if geo:
-            coords.append((geo[0], geo[1]))
+            latlons.append(geo)
             names.append(ex)
 
-    coords.append((pt1[0], pt1[1]))
+    latlons.append(pt1)
     names.append("Destino")
 
-    if len(coords) < 3:
+    if len(latlons) < 3:
         log.error("❌ Selecione ao menos um POI ou extra.")
         return
 
-    log.info("⏳ Obtendo altitudes…")
-    alts = batch_altitude(coords)
-    coords = [(lat, lon, alt) for (lat, lon), alt in zip(coords, alts)]
-
-    log.info("⏳ Calculando matriz…")
-    dist = osrm_table([(lat, lon) for lat, lon, _ in coords])
+    # Uma única matriz (lat, lon, alt); a visão [:, :2] alimenta as APIs
+    coords = np.zeros((len(latlons), 3), dtype=np.float64)
+    coords[:, :2] = latlons
     weight = float(elev_weight.value)
-    penal = apply_elevation_penalty(dist, coords, weight)
-
+    # A altitude só entra no custo pela penalidade de subida (o mapa usa
+    # apenas lat/lon): com peso zero a consulta ao Open-Elevation é evitada
+    use_alt = weight > 0
     end_idx = len(coords) - 1
-    best = min(range(1, end_idx), key=lambda i: penal[i][end_idx])
-
-    log.info("🚦 Resolvendo TSP…")
-    route = solve_tsp(penal, 0, best)
-    if not route:
-        log.error("❌ TSP falhou")
-        return
-    route.append(end_idx)
+    if len(coords) == 3:
+        # Uma única parada: não há o que otimizar nem matriz a consultar
+        route = [0, 1, 2]
+    elif len(coords) == 4:
+        # Duas paradas: basta a distância de cada uma até o destino
+        log.info("⏳ Obtendo altitudes e distâncias…" if use_alt else "⏳ Obtendo distâncias…")
+        coro = _altitudes_e_distancias(
+            coords[:, :2].tolist(), use_alt, sources=[1, 2], destinations=[end_idx]
+        )
+        coords[:, 2], dist = asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+        alts = coords[:, 2]
+        # Pares sem rota (``None`` do OSRM) não podem vencer o argmin como NaN
+        to_end = finite_distances(dist)[:, 0]
+        to_end += np.maximum(alts[end_idx] - alts[1:end_idx], 0.0) * weight
+        best = int(to_end.argmin()) + 1
+        route = [0, 3 - best, best, end_idx]
+    else:
+        log.info("⏳ Obtendo altitudes e calculando matriz…" if use_alt else "⏳ Calculando matriz…")
+        coro = _altitudes_e_distancias(coords[:, :2].tolist(), use_alt, symmetric=True)
+        coords[:, 2], dist = asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+        # Uma única conversão para ``ndarray``; a penalidade é somada in-place
+        penal_np = apply_elevation_penalty(
+            finite_distances(dist), coords, weight, copy=False
+        )
+        best = int(penal_np[1:end_idx, end_idx].argmin()) + 1
+
+        log.info("🚦 Resolvendo TSP…")
+        route = solve_tsp(penal_np, 0, best)
+        if not route:
+            log.error("❌ TSP falhou")
+            return
+        route.append(end_idx)
 
     log.info("🗺️ Gerando mapa…")
     m = build_map(route, coords, names)
     filename = "rota_otimizada.html"
-    m.save(filename)
-    log.info(f"✅ HTML salvo: {filename}")
+    if save_map(m, filename):
+        log.info(f"✅ HTML salvo: {filename}")
+    else:
+        log.info(f"✅ HTML inalterado: {filename}")
     display(FileLink(filename, result_html_prefix="🔗 ", result_html_suffix=" para download"))
 
 
 def launch_ui() -> None:
     """Exibe a interface interativa no notebook."""
 
-    load_pois_btn.on_click(on_load_pois)
-    same_cb.observe(on_same_change, "value")
-    compute_btn.on_click(on_compute)
-
+    _build_widgets()
     ui = widgets.HBox(
         [
             widgets.VBox(
-                [city_widget, load_pois_btn, widgets.Label("Selecione POIs:"), pois_box]
+                [city_widget, load_pois_btn, widgets.Label("Selecione POIs:"), pois_select]
             ),
             widgets.VBox([
                 start_txt,